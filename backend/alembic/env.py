@@ -2,7 +2,8 @@ import asyncio
 from logging.config import fileConfig
 
 from alembic import context
-from sqlalchemy import Connection, inspect, Inspector
+from alembic.operations import MigrateOperation, Operations
+from sqlalchemy import Connection, inspect, Inspector, text
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.sql.ddl import CreateSchema
 
@@ -31,6 +32,117 @@ target_metadata = meta
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+@Operations.register_operation("create_index_concurrently")
+class CreateIndexConcurrentlyOp(MigrateOperation):
+    """
+    Build an index with CREATE INDEX CONCURRENTLY, so writes to the table are
+    not blocked while it is built. It only takes a SHARE UPDATE EXCLUSIVE lock
+    and waits for the transactions running when it starts.
+
+    Concurrent builds can not run inside a transaction, so the index is built in
+    an autocommit block. A failed concurrent build leaves an invalid index
+    behind, which is dropped before building again, so a failed migration can
+    simply be rerun. Each migration runs in its own transaction, so the
+    migrations before it are already committed.
+
+    Usage in a migration: `op.create_index_concurrently("ix_name", "table", ["column"], schema=...)`
+    """
+
+    def __init__(
+            self,
+            index_name: str,
+            table_name: str,
+            columns: list[str],
+            schema: str | None = None,
+            unique: bool = False,
+            include: list[str] | None = None,
+    ) -> None:
+        self.index_name = index_name
+        self.table_name = table_name
+        self.columns = columns
+        self.schema = schema
+        self.unique = unique
+        self.include = include
+
+    @classmethod
+    def create_index_concurrently(cls, operations: Operations, index_name: str, table_name: str, columns: list[str],
+                                  **kwargs) -> None:
+        return operations.invoke(cls(index_name, table_name, columns, **kwargs))
+
+    def reverse(self) -> "DropIndexConcurrentlyOp":
+        return DropIndexConcurrentlyOp(self.index_name, self.table_name, schema=self.schema)
+
+
+@Operations.register_operation("drop_index_concurrently")
+class DropIndexConcurrentlyOp(MigrateOperation):
+    """
+    Drop an index with DROP INDEX CONCURRENTLY in an autocommit block.
+
+    Usage in a migration: `op.drop_index_concurrently("ix_name", "table", schema=...)`
+    """
+
+    def __init__(
+            self,
+            index_name: str,
+            table_name: str,
+            schema: str | None = None,
+    ) -> None:
+        self.index_name = index_name
+        self.table_name = table_name
+        self.schema = schema
+
+    @classmethod
+    def drop_index_concurrently(cls, operations: Operations, index_name: str, table_name: str, **kwargs) -> None:
+        return operations.invoke(cls(index_name, table_name, **kwargs))
+
+
+@Operations.implementation_for(CreateIndexConcurrentlyOp)
+def create_index_concurrently(operations: Operations, operation: CreateIndexConcurrentlyOp) -> None:
+    with operations.get_context().autocommit_block():
+        if not context.is_offline_mode():
+            is_valid = operations.get_bind().scalar(
+                text(
+                    "SELECT index.indisvalid FROM pg_index AS index "
+                    "JOIN pg_class AS class ON class.oid = index.indexrelid "
+                    "JOIN pg_namespace AS namespace ON namespace.oid = class.relnamespace "
+                    "WHERE class.relname = :index_name AND namespace.nspname = :schema"
+                ),
+                {"index_name": operation.index_name, "schema": operation.schema or "public"},
+            )
+
+            if is_valid is False:
+                operations.drop_index(
+                    operation.index_name,
+                    table_name=operation.table_name,
+                    schema=operation.schema,
+                    postgresql_concurrently=True,
+                    if_exists=True,
+                )
+
+        operations.create_index(
+            operation.index_name,
+            operation.table_name,
+            operation.columns,
+            schema=operation.schema,
+            unique=operation.unique,
+            postgresql_include=operation.include or [],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+@Operations.implementation_for(DropIndexConcurrentlyOp)
+def drop_index_concurrently(operations: Operations, operation: DropIndexConcurrentlyOp) -> None:
+    with operations.get_context().autocommit_block():
+        operations.drop_index(
+            operation.index_name,
+            table_name=operation.table_name,
+            schema=operation.schema,
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
 def include_name(name, type_, parent_names):
     if type_ == "schema":
         return name == settings.db_schema
@@ -57,6 +169,7 @@ async def run_migrations_offline() -> None:
         dialect_opts={"paramstyle": "named"},
         include_schemas=True,
         version_table_schema=settings.db_schema,
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -75,6 +188,8 @@ def do_run_migrations(connection: Connection) -> None:
         include_name=include_name,
         include_schemas=True,
         version_table_schema=settings.db_schema,
+        # Needed by concurrent index builds, which commit the transaction they run in
+        transaction_per_migration=True,
     )
     inspector: Inspector = inspect(connection)
 
@@ -0,0 +1,35 @@
+"""add url code sequence
+
+Revision ID: 5c1e7a3b9d24
+Revises: 08b97f8330d2
+Create Date: 2026-10-18 09:12:31.204518+00:00
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c1e7a3b9d24"
+down_revision: Union[str, None] = "08b97f8330d2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        sa.schema.CreateSequence(
+            sa.Sequence("url_code_seq", schema="url-shortener")
+        )
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        sa.schema.DropSequence(
+            sa.Sequence("url_code_seq", schema="url-shortener")
+        )
+    )
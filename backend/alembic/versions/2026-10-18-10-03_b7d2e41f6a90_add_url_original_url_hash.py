@@ -0,0 +1,129 @@
+"""add url original url hash
+
+Revision ID: b7d2e41f6a90
+Revises: 5c1e7a3b9d24
+Create Date: 2026-10-18 10:03:57.811342+00:00
+
+The unique index is built concurrently while the column is still empty, so
+writes are not blocked and new URLs are deduplicated from the start. Existing
+rows are then hashed in batches of ids with the same normalization the
+application applies, every batch committed on its own. Only the oldest row of
+each duplicated URL gets a hash, the others keep NULL. Offline SQL can not run
+the normalization, the backfill is skipped there and runs with an online upgrade.
+"""
+
+import hashlib
+from typing import Sequence, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d2e41f6a90"
+down_revision: Union[str, None] = "5c1e7a3b9d24"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10_000
+
+# The normalization of app.deps as of this revision, copied so later changes
+# to the application do not change what this revision computes
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21, "ftps": 990}
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = parts.hostname or ""
+
+        if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{parts.port}"
+    except ValueError:
+        return url
+
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def hash_url(url: str) -> bytes:
+    return hashlib.sha256(normalize_url(url).encode()).digest()
+
+
+def backfill_url_hashes() -> None:
+    connection = op.get_bind()
+    last_id = 0
+
+    while True:
+        url_rows = connection.execute(
+            sa.text(
+                """
+                SELECT id, original_url FROM "url-shortener".url
+                WHERE id > :last_id AND original_url_hash IS NULL
+                ORDER BY id
+                LIMIT :batch_size
+                """
+            ),
+            {"last_id": last_id, "batch_size": BACKFILL_BATCH_SIZE},
+        ).all()
+
+        if not url_rows:
+            return
+
+        # Rows are read in id order, so the first row of every hash is the oldest
+        url_ids_by_hash: dict[bytes, int] = {}
+
+        for url_id, original_url in url_rows:
+            url_ids_by_hash.setdefault(hash_url(original_url), url_id)
+
+        statement = sa.text(
+            """
+            UPDATE "url-shortener".url
+            SET original_url_hash = batch.original_url_hash
+            FROM unnest(CAST(:url_ids AS BIGINT[]), CAST(:url_hashes AS BYTEA[])) AS batch(id, original_url_hash)
+            WHERE url.id = batch.id AND NOT EXISTS (
+                SELECT 1 FROM "url-shortener".url AS existing
+                WHERE existing.original_url_hash = batch.original_url_hash
+            )
+            """
+        )
+        params = {"url_ids": list(url_ids_by_hash.values()), "url_hashes": list(url_ids_by_hash)}
+
+        try:
+            connection.execute(statement, params)
+        except sa.exc.IntegrityError:
+            # The application inserted one of the URLs meanwhile, the retry skips it
+            connection.execute(statement, params)
+
+        last_id = url_rows[-1][0]
+
+
+def upgrade() -> None:
+    op.add_column(
+        "url",
+        sa.Column("original_url_hash", sa.LargeBinary(length=32), nullable=True),
+        schema="url-shortener",
+    )
+    op.create_index_concurrently(
+        "ix_url_original_url_hash",
+        "url",
+        ["original_url_hash"],
+        schema="url-shortener",
+        unique=True,
+    )
+
+    if not context.is_offline_mode():
+        with op.get_context().autocommit_block():
+            backfill_url_hashes()
+
+
+def downgrade() -> None:
+    op.drop_index_concurrently("ix_url_original_url_hash", "url", schema="url-shortener")
+    op.drop_column("url", "original_url_hash", schema="url-shortener")
@@ -0,0 +1,58 @@
+"""add url code covering index
+
+Revision ID: e3a9c6f1d205
+Revises: b7d2e41f6a90
+Create Date: 2026-10-18 11:20:14.502913+00:00
+
+Replaces the index of the unique constraint on code with a unique index that
+includes original_url and id, so redirect lookups are answered with an
+index-only scan instead of an index scan plus a heap fetch. Index-only scans
+need the pages to be marked all-visible, run VACUUM on the table after the
+upgrade. Verify with:
+
+    EXPLAIN SELECT id, code, original_url FROM "url-shortener".url WHERE code = 'abc';
+
+which should show `Index Only Scan using ix_url_code_covering`.
+
+The index is built concurrently, so writes are not blocked. The constraint is
+dropped after the index is valid, which takes a brief exclusive lock bounded
+by the lock timeout. Index entries are limited to about 2.7kB, the upgrade
+fails if a stored URL is longer than that and can be rerun after fixing it.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e3a9c6f1d205"
+down_revision: Union[str, None] = "b7d2e41f6a90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index_concurrently(
+        "ix_url_code_covering",
+        "url",
+        ["code"],
+        schema="url-shortener",
+        unique=True,
+        include=["original_url", "id"],
+    )
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.drop_constraint("url_code_key", "url", schema="url-shortener", type_="unique")
+
+
+def downgrade() -> None:
+    op.create_index_concurrently(
+        "url_code_key",
+        "url",
+        ["code"],
+        schema="url-shortener",
+        unique=True,
+    )
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.execute('ALTER TABLE "url-shortener".url ADD CONSTRAINT url_code_key UNIQUE USING INDEX url_code_key')
+    op.drop_index_concurrently("ix_url_code_covering", "url", schema="url-shortener")
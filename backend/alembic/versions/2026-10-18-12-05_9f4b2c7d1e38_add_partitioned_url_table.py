@@ -0,0 +1,175 @@
+"""add partitioned url table
+
+Revision ID: 9f4b2c7d1e38
+Revises: e3a9c6f1d205
+Create Date: 2026-10-18 12:05:41.236097+00:00
+
+First step of partitioning the url table by a hash of code, the number of
+partitions is taken from the DB_URL_PARTITIONS setting. This revision only
+adds tables, the url table keeps serving the application:
+
+- url_partitioned, the partitioned copy of url. A unique constraint of a
+  partitioned table has to include the partition key, so the primary key
+  becomes (id, code) and ids keep coming from the url_id_seq sequence.
+- url_hash, the original URL hash of every URL and its code. The unique index
+  on original_url_hash can not be kept on a table partitioned by code, this
+  unpartitioned table deduplicates URLs instead.
+- A trigger on url that mirrors every insert, update and delete to both tables.
+- url_partition_backfill, the progress of copying the existing rows.
+
+Copy the existing rows with `python partition_urls.py`, then upgrade to the
+next revision, which swaps the tables. Small tables can skip the copy, the
+swap copies up to SWAP_COPY_LIMIT remaining rows itself.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9f4b2c7d1e38"
+down_revision: Union[str, None] = "e3a9c6f1d205"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+URL_COLUMNS = (
+    "id, name, code, original_url, original_url_hash, description, "
+    "access_count, last_access_date, creation_date"
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "url_hash",
+        sa.Column("original_url_hash", sa.LargeBinary(length=32), nullable=False),
+        sa.Column("code", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("original_url_hash", name="url_hash_pkey"),
+        sa.UniqueConstraint("code", name="url_hash_code_key"),
+        schema="url-shortener",
+    )
+    op.create_table(
+        "url_partitioned",
+        sa.Column(
+            "id",
+            sa.BigInteger(),
+            server_default=sa.text("""nextval('"url-shortener".url_id_seq'::regclass)"""),
+            nullable=False,
+        ),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("code", sa.String(), nullable=False),
+        sa.Column("original_url", sa.String(), nullable=False),
+        sa.Column("original_url_hash", sa.LargeBinary(length=32), nullable=True),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("access_count", sa.BigInteger(), nullable=False),
+        sa.Column("last_access_date", sa.DateTime(), nullable=False),
+        sa.Column("creation_date", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", "code", name="url_partitioned_pkey"),
+        schema="url-shortener",
+        postgresql_partition_by="HASH (code)",
+    )
+
+    for remainder in range(settings.db_url_partitions):
+        op.execute(
+            f"""
+            CREATE TABLE "url-shortener".url_p{remainder}
+            PARTITION OF "url-shortener".url_partitioned
+            FOR VALUES WITH (MODULUS {settings.db_url_partitions}, REMAINDER {remainder})
+            """
+        )
+
+    # Renamed to ix_url_code_covering by the swap, index names are unique per schema
+    op.create_index(
+        "ix_url_partitioned_code_covering",
+        "url_partitioned",
+        ["code"],
+        unique=True,
+        schema="url-shortener",
+        postgresql_include=["original_url", "id"],
+    )
+    op.create_table(
+        "url_partition_backfill",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        # Rows up to this id are copied
+        sa.Column("last_id", sa.BigInteger(), nullable=False),
+        # Rows inserted after the trigger was created are mirrored by it
+        sa.Column("max_id", sa.BigInteger(), nullable=False),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="url_partition_backfill_pkey"),
+        schema="url-shortener",
+    )
+    # An update that changes the code is mirrored as a delete and an insert,
+    # the code is the partition key. The insert overwrites a row the backfill
+    # copied concurrently, so the newest version always wins.
+    op.execute(
+        f"""
+        CREATE FUNCTION "url-shortener".mirror_url() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.code <> NEW.code) THEN
+                DELETE FROM "url-shortener".url_partitioned
+                WHERE id = OLD.id AND code = OLD.code;
+            END IF;
+
+            IF TG_OP = 'DELETE' OR (
+                TG_OP = 'UPDATE'
+                AND (OLD.code, OLD.original_url_hash) IS DISTINCT FROM (NEW.code, NEW.original_url_hash)
+            ) THEN
+                DELETE FROM "url-shortener".url_hash
+                WHERE original_url_hash = OLD.original_url_hash AND code = OLD.code;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO "url-shortener".url_partitioned ({URL_COLUMNS})
+                VALUES (
+                    NEW.id, NEW.name, NEW.code, NEW.original_url, NEW.original_url_hash,
+                    NEW.description, NEW.access_count, NEW.last_access_date, NEW.creation_date
+                )
+                ON CONFLICT (id, code) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    original_url = EXCLUDED.original_url,
+                    original_url_hash = EXCLUDED.original_url_hash,
+                    description = EXCLUDED.description,
+                    access_count = EXCLUDED.access_count,
+                    last_access_date = EXCLUDED.last_access_date,
+                    creation_date = EXCLUDED.creation_date;
+
+                IF NEW.original_url_hash IS NOT NULL THEN
+                    INSERT INTO "url-shortener".url_hash (original_url_hash, code)
+                    VALUES (NEW.original_url_hash, NEW.code)
+                    ON CONFLICT DO NOTHING;
+                END IF;
+            END IF;
+
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # Creating the trigger waits for running writes and blocks new ones until
+    # commit, so every row is either visible to max(id) below or mirrored
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.execute(
+        """
+        CREATE TRIGGER mirror_url
+        AFTER INSERT OR UPDATE OR DELETE ON "url-shortener".url
+        FOR EACH ROW EXECUTE FUNCTION "url-shortener".mirror_url()
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO "url-shortener".url_partition_backfill (id, last_id, max_id, completed_at)
+        SELECT 1, 0, coalesce(max(id), 0), CASE WHEN max(id) IS NULL THEN now() END
+        FROM "url-shortener".url
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER mirror_url ON "url-shortener".url')
+    op.execute('DROP FUNCTION "url-shortener".mirror_url()')
+    op.drop_table("url_partition_backfill", schema="url-shortener")
+    op.drop_table("url_partitioned", schema="url-shortener")
+    op.drop_table("url_hash", schema="url-shortener")
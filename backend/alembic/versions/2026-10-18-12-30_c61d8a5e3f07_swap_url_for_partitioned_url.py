@@ -0,0 +1,141 @@
+"""swap url for partitioned url
+
+Revision ID: c61d8a5e3f07
+Revises: 9f4b2c7d1e38
+Create Date: 2026-10-18 12:30:08.719524+00:00
+
+Second step of partitioning the url table. Under a brief exclusive lock on
+url, bounded by the lock timeout, the rows not copied by partition_urls.py
+yet are copied, the mirror trigger is dropped and url_partitioned takes the
+name url. The old table is kept as url_unpartitioned, drop it once the
+partitioned table is verified. Deploy the application version of this
+revision after the swap, it deduplicates URLs through url_hash.
+
+Lookups by code are pruned to a single partition, verify with:
+
+    EXPLAIN SELECT id, code, original_url FROM "url-shortener".url WHERE code = 'abc';
+
+which should scan only one url_p<n> partition.
+
+The downgrade copies every row back into url_unpartitioned under an exclusive
+lock on both tables, so it blocks the application for the whole copy.
+"""
+
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c61d8a5e3f07"
+down_revision: Union[str, None] = "9f4b2c7d1e38"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Most rows the swap copies itself while holding the exclusive lock
+SWAP_COPY_LIMIT = 100_000
+
+URL_COLUMNS = (
+    "id, name, code, original_url, original_url_hash, description, "
+    "access_count, last_access_date, creation_date"
+)
+
+
+def upgrade() -> None:
+    if not context.is_offline_mode():
+        remaining = op.get_bind().scalar(
+            sa.text('SELECT max_id - last_id FROM "url-shortener".url_partition_backfill WHERE id = 1')
+        )
+
+        if remaining > SWAP_COPY_LIMIT:
+            raise RuntimeError(
+                f"{remaining} ids of the url table are not copied yet, run `python partition_urls.py` first"
+            )
+
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.execute('LOCK TABLE "url-shortener".url IN ACCESS EXCLUSIVE MODE')
+    # Rows above max_id were mirrored by the trigger, only the uncopied older ones are left
+    op.execute(
+        f"""
+        INSERT INTO "url-shortener".url_partitioned ({URL_COLUMNS})
+        SELECT {URL_COLUMNS} FROM "url-shortener".url
+        WHERE id > (SELECT last_id FROM "url-shortener".url_partition_backfill WHERE id = 1)
+            AND id <= (SELECT max_id FROM "url-shortener".url_partition_backfill WHERE id = 1)
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO "url-shortener".url_hash (original_url_hash, code)
+        SELECT original_url_hash, code FROM "url-shortener".url
+        WHERE id > (SELECT last_id FROM "url-shortener".url_partition_backfill WHERE id = 1)
+            AND id <= (SELECT max_id FROM "url-shortener".url_partition_backfill WHERE id = 1)
+            AND original_url_hash IS NOT NULL
+        ON CONFLICT DO NOTHING
+        """
+    )
+    # The function is dropped by the downgrade of the previous revision
+    op.execute('DROP TRIGGER mirror_url ON "url-shortener".url')
+    op.drop_table("url_partition_backfill", schema="url-shortener")
+
+    op.rename_table("url", "url_unpartitioned", schema="url-shortener")
+    op.execute('ALTER TABLE "url-shortener".url_unpartitioned RENAME CONSTRAINT url_pkey TO url_unpartitioned_pkey')
+    op.execute('ALTER INDEX "url-shortener".ix_url_code_covering RENAME TO ix_url_unpartitioned_code_covering')
+    op.execute(
+        'ALTER INDEX "url-shortener".ix_url_original_url_hash RENAME TO ix_url_unpartitioned_original_url_hash'
+    )
+
+    op.rename_table("url_partitioned", "url", schema="url-shortener")
+    op.execute('ALTER TABLE "url-shortener".url RENAME CONSTRAINT url_partitioned_pkey TO url_pkey')
+    op.execute('ALTER INDEX "url-shortener".ix_url_partitioned_code_covering RENAME TO ix_url_code_covering')
+    # Dropping the old table must not drop the sequence of the ids
+    op.execute('ALTER SEQUENCE "url-shortener".url_id_seq OWNED BY "url-shortener".url.id')
+
+
+def downgrade() -> None:
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.execute('LOCK TABLE "url-shortener".url, "url-shortener".url_unpartitioned IN ACCESS EXCLUSIVE MODE')
+    op.execute('TRUNCATE "url-shortener".url_unpartitioned')
+    op.execute(
+        f"""
+        INSERT INTO "url-shortener".url_unpartitioned ({URL_COLUMNS})
+        SELECT {URL_COLUMNS} FROM "url-shortener".url
+        """
+    )
+    op.execute('ALTER SEQUENCE "url-shortener".url_id_seq OWNED BY "url-shortener".url_unpartitioned.id')
+
+    op.execute('ALTER INDEX "url-shortener".ix_url_code_covering RENAME TO ix_url_partitioned_code_covering')
+    op.execute('ALTER TABLE "url-shortener".url RENAME CONSTRAINT url_pkey TO url_partitioned_pkey')
+    op.rename_table("url", "url_partitioned", schema="url-shortener")
+
+    op.execute(
+        'ALTER INDEX "url-shortener".ix_url_unpartitioned_original_url_hash RENAME TO ix_url_original_url_hash'
+    )
+    op.execute('ALTER INDEX "url-shortener".ix_url_unpartitioned_code_covering RENAME TO ix_url_code_covering')
+    op.execute('ALTER TABLE "url-shortener".url_unpartitioned RENAME CONSTRAINT url_unpartitioned_pkey TO url_pkey')
+    op.rename_table("url_unpartitioned", "url", schema="url-shortener")
+
+    # Both tables hold the same rows again, so the copy is complete
+    op.create_table(
+        "url_partition_backfill",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("last_id", sa.BigInteger(), nullable=False),
+        sa.Column("max_id", sa.BigInteger(), nullable=False),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="url_partition_backfill_pkey"),
+        schema="url-shortener",
+    )
+    op.execute(
+        """
+        INSERT INTO "url-shortener".url_partition_backfill (id, last_id, max_id, completed_at)
+        SELECT 1, coalesce(max(id), 0), coalesce(max(id), 0), now() FROM "url-shortener".url
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER mirror_url
+        AFTER INSERT OR UPDATE OR DELETE ON "url-shortener".url
+        FOR EACH ROW EXECUTE FUNCTION "url-shortener".mirror_url()
+        """
+    )
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+from collections.abc import Iterable, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import schemas
+from app.core.config import settings
+from app.models import Url
+
+# Codes hashed per thread call while building
+BUILD_PARTITION_SIZE = 10_000
+# Fraction of the rebuild interval the workers' rebuilds are spread over
+REBUILD_JITTER = 0.1
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set of strings.
+
+    Membership checks can return false positives at roughly the configured
+    rate once `capacity` items were added, but never false negatives.
+    Items can not be removed.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float) -> None:
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.size_bits, self.hash_count = self.optimal_size(capacity, false_positive_rate)
+        self.bits = bytearray((self.size_bits + 7) // 8)
+        self.items = 0
+
+    @staticmethod
+    def optimal_size(capacity: int, false_positive_rate: float) -> tuple[int, int]:
+        """
+        Number of bits and hash functions for the given capacity and false positive rate
+        :param capacity: Number of items the filter is sized for
+        :param false_positive_rate: Target false positive rate at capacity
+        :return: Tuple of the number of bits and the number of hash functions
+        """
+        size_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(size_bits / capacity * math.log(2)))
+
+        return size_bits, hash_count
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+        return ((first + index * second) % self.size_bits for index in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.items += 1
+
+    def update(self, items: Iterable[str]) -> None:
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hash_count * self.items / self.size_bits)) ** self.hash_count
+
+
+class CodeFilter:
+    """
+    Worker local Bloom filter of every existing short code.
+
+    Lookups of codes that are not in the filter are rejected before any
+    cache or database access. Until the first build finishes every code is
+    treated as possibly existing. Codes created by any worker arrive through
+    cache invalidations, and the filter is rebuilt periodically. When
+    invalidations may have been missed the filter is dropped, so every code
+    is possibly existing again until it is rebuilt. Deleted codes stay in
+    the filter until the next rebuild.
+
+    Builds hash the codes in a thread, so the event loop keeps serving
+    requests, and rebuilds are spread out with a random jitter so the
+    workers do not all rebuild at the same time.
+    """
+
+    def __init__(
+            self,
+            capacity: int = settings.code_filter_capacity,
+            false_positive_rate: float = settings.code_filter_false_positive_rate,
+            rebuild_interval_seconds: float = settings.code_filter_rebuild_interval_seconds,
+            enabled: bool = settings.code_filter_enabled,
+    ) -> None:
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.rebuild_interval_seconds = rebuild_interval_seconds
+        self.enabled = enabled
+        self.rejected = 0
+        self._filter: BloomFilter | None = None
+        # Codes added while a build runs, added to the new filter once it is complete
+        self._building_codes: list[str] | None = None
+        # Incremented when invalidations may have been missed, a build of an older generation is discarded
+        self._generation = 0
+        self._rebuild_requested = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, url_code: str) -> bool:
+        """
+        Check if the code may exist
+        :param url_code: The short code to check
+        :return: False if the code surely does not exist, True otherwise
+        """
+        if not self.enabled or self._filter is None or url_code in self._filter:
+            return True
+
+        self.rejected += 1
+
+        return False
+
+    def add(self, url_code: str) -> None:
+        if self._filter is not None:
+            self._filter.add(url_code)
+
+        if self._building_codes is not None:
+            self._building_codes.append(url_code)
+
+    def invalidated(self, url_codes: Sequence[str]) -> None:
+        for url_code in url_codes:
+            self.add(url_code)
+
+    def resubscribed(self) -> None:
+        # Codes created while disconnected are missing, so nothing can be rejected until the rebuild
+        self._filter = None
+        self._generation += 1
+        self._rebuild_requested.set()
+
+    async def build(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        """
+        Build a new filter from the codes in the database by streaming them in one query,
+        codes added while building are added to both the current and the new filter.
+        The codes are hashed in a thread, one partition of the stream at a time
+        :param session_factory: Factory used to open the database session
+        :return: None
+        """
+        start = time.perf_counter()
+        generation = self._generation
+        building = BloomFilter(self.capacity, self.false_positive_rate)
+        self._building_codes = []
+
+        try:
+            async with session_factory() as session:
+                url_codes = await session.stream_scalars(
+                    select(Url.code).execution_options(yield_per=BUILD_PARTITION_SIZE)
+                )
+
+                async for partition in url_codes.partitions(BUILD_PARTITION_SIZE):
+                    await asyncio.to_thread(building.update, partition)
+
+            if generation != self._generation:
+                logging.warning("Discarded the code filter build, invalidations were missed while it ran")
+                return
+
+            # No await until the swap, so no code is added between the two
+            building.update(self._building_codes)
+            self._filter = building
+        finally:
+            self._building_codes = None
+
+        stats = self.stats()
+        logging.info(
+            f"Built code filter with {stats.items} codes in {time.perf_counter() - start:.1f}s, "
+            f"size: {stats.size_bytes} bytes, "
+            f"estimated false positive rate: {stats.estimated_false_positive_rate:.5f}"
+        )
+
+    async def run(
+            self,
+            session_factory: async_sessionmaker[AsyncSession],
+            retry_delay_seconds: float = 10,
+    ) -> None:
+        """
+        Build the filter and rebuild it every rebuild interval or when requested
+        :param session_factory: Factory used to open the database session
+        :param retry_delay_seconds: Seconds to wait before retrying a failed build
+        :return: None
+        """
+        while True:
+            self._rebuild_requested.clear()
+            delay_seconds = self.rebuild_interval_seconds
+
+            try:
+                await self.build(session_factory)
+            except Exception as ex:
+                logging.error(f"Could not build the code filter, ex: {ex}")
+                delay_seconds = retry_delay_seconds
+
+            try:
+                await asyncio.wait_for(
+                    self._rebuild_requested.wait(),
+                    delay_seconds * random.uniform(1 - REBUILD_JITTER, 1 + REBUILD_JITTER),
+                )
+            except TimeoutError:
+                pass
+
+    def stats(self) -> schemas.CodeFilterStats:
+        size_bits, hash_count = BloomFilter.optimal_size(self.capacity, self.false_positive_rate)
+
+        return schemas.CodeFilterStats(
+            enabled=self.enabled,
+            ready=self.ready,
+            capacity=self.capacity,
+            items=self._filter.items if self._filter else 0,
+            size_bytes=(size_bits + 7) // 8,
+            hash_count=hash_count,
+            configured_false_positive_rate=self.false_positive_rate,
+            estimated_false_positive_rate=self._filter.estimated_false_positive_rate() if self._filter else 0,
+            rejected=self.rejected,
+        )
+
+
+code_filter = CodeFilter()
@@ -0,0 +1,550 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Any, Protocol
+
+from pydantic import ValidationError
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app import schemas
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import settings
+from app.core.redis import redis_breaker, redis_client, redis_pubsub_client
+
+# Value stored for codes that are known not to exist
+NOT_FOUND_VALUE = ""
+# Seconds between checks for the warm up codes computed by another worker
+WARM_UP_CODES_POLL_SECONDS = 0.1
+# Deletes a lock only while it still holds the token of the worker releasing it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU map with a TTL per entry.
+
+    Each worker process holds its own instance, so it is not shared
+    between gunicorn workers and needs no locking inside the event loop.
+    """
+
+    def __init__(
+            self,
+            max_size: int = settings.local_cache_max_size,
+            ttl_seconds: float = settings.local_cache_ttl_seconds,
+            enabled: bool = settings.local_cache_enabled,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """
+        Get the value for the given key if it exists and did not expire
+        :param key: The key to look up
+        :return: Tuple of whether the key was found and its value
+        """
+        if not self.enabled:
+            return False, None
+
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        expires_at, value = entry
+
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return True, value
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        """
+        Set the value for the given key, evicting the least recently used keys when full
+        :param key: The key to set
+        :param value: The value to store
+        :param ttl_seconds: Seconds before the key expires, defaults to the cache TTL
+        :return: None
+        """
+        if not self.enabled or self.max_size <= 0:
+            return
+
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> schemas.LocalCacheStats:
+        return schemas.LocalCacheStats(
+            size=len(self._entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class InvalidationListener(Protocol):
+    """Worker local state that has to follow cache invalidations of any worker."""
+
+    def invalidated(self, url_codes: Sequence[str]) -> None:
+        """Called with the codes invalidated by any worker."""
+
+    def resubscribed(self) -> None:
+        """Called when invalidations may have been missed while disconnected."""
+
+
+class UrlCache:
+    """
+    Read-through cache for short code resolution.
+
+    Maps a short code to the original URL and its id so the redirect
+    path can skip the database. Unknown codes are cached as well, with a
+    shorter TTL, so repeated lookups of missing codes do not reach the database.
+
+    Lookups go through the worker local warm map and cache first and then Redis.
+    Invalidations are published on a Redis channel so every worker drops its
+    local copies and notifies its registered listeners. Invalidations that
+    can not be published are retried in the background until Redis accepts them.
+    Redis errors are logged and treated as a cache miss. Redis calls go through
+    the circuit breaker, while it is open they are skipped instead of waiting
+    out the socket timeout.
+    """
+
+    def __init__(
+            self,
+            client: aioredis.Redis,
+            local: LocalCache,
+            ttl_seconds: int = settings.cache_ttl_seconds,
+            negative_ttl_seconds: int = settings.cache_negative_ttl_seconds,
+            enabled: bool = settings.cache_enabled,
+            pubsub_client: aioredis.Redis | None = None,
+            breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.client = client
+        self.breaker = breaker
+        # Client without a read timeout for the subscription, defaults to the client
+        self.pubsub_client = pubsub_client or client
+        self.local = local
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.enabled = enabled
+        self.invalidation_channel = f"{settings.cache_key_prefix}:invalidate"
+        self.listeners: list[InvalidationListener] = []
+        # Codes whose invalidation could not be published yet, retried in the background
+        self._unpublished: set[str] = set()
+        self._republish_task: asyncio.Task | None = None
+        # Codes preloaded at startup with the time they expire, kept as long as a Redis entry
+        self.warm: dict[str, tuple[float, schemas.UrlCached]] = {}
+        # Codes invalidated while the warm up streams rows read before the invalidation
+        self._warm_up_invalidated: set[str] | None = None
+        # Set when invalidations may have been missed during the warm up
+        self._warm_up_stale = False
+
+    @staticmethod
+    def key_for(url_code: str) -> str:
+        return f"{settings.cache_key_prefix}:code:{url_code}"
+
+    def _redis_available(self) -> bool:
+        if self.breaker is None or self.breaker.closed:
+            return True
+
+        self.breaker.fallback_hits += 1
+
+        return False
+
+    def _redis_succeeded(self) -> None:
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def _redis_failed(self, err: RedisError) -> None:
+        if self.breaker is not None:
+            self.breaker.record_failure(err)
+
+    async def get(self, url_code: str) -> tuple[bool, schemas.UrlCached | None]:
+        """
+        Get the cached URL for the given code
+        :param url_code: The short code to look up
+        :return: Tuple of whether the cache had an entry and the cached URL,
+        the URL is None when the code is cached as not found
+        """
+        warm_entry = self.warm.get(url_code)
+
+        if warm_entry is not None:
+            expires_at, url_cached = warm_entry
+
+            if expires_at > time.monotonic():
+                return True, url_cached
+
+            del self.warm[url_code]
+
+        is_cached, url_cached = self.local.get(url_code)
+
+        if is_cached or not self.enabled or not self._redis_available():
+            return is_cached, url_cached
+
+        try:
+            value = await self.client.get(self.key_for(url_code))
+        except RedisError as err:
+            logging.error(f"Could not read url code from cache, ex: {err}")
+            self._redis_failed(err)
+            return False, None
+
+        self._redis_succeeded()
+
+        if value is None:
+            return False, None
+
+        if value == NOT_FOUND_VALUE:
+            self.local.set(url_code, None, self.negative_ttl_seconds)
+            return True, None
+
+        try:
+            url_cached = schemas.UrlCached.model_validate_json(value)
+        except ValidationError as err:
+            logging.error(f"Invalid cached value for url code {url_code}, ex: {err}")
+            return False, None
+
+        self.local.set(url_code, url_cached)
+
+        return True, url_cached
+
+    async def set(self, url_code: str, url_cached: schemas.UrlCached | None) -> None:
+        """
+        Cache the given URL for the code, None caches the code as not found
+        :param url_code: The short code to cache
+        :param url_cached: The URL to cache or None if the code does not exist
+        :return: None
+        """
+        if url_cached is None:
+            value, ttl = NOT_FOUND_VALUE, self.negative_ttl_seconds
+        else:
+            value, ttl = url_cached.model_dump_json(), self.ttl_seconds
+
+        self.local.set(url_code, url_cached, ttl)
+
+        if not self.enabled or not self._redis_available():
+            return
+
+        try:
+            await self.client.set(self.key_for(url_code), value, ex=ttl)
+        except RedisError as err:
+            logging.error(f"Could not write url code to cache, ex: {err}")
+            self._redis_failed(err)
+        else:
+            self._redis_succeeded()
+
+    def start_warm_up(self) -> None:
+        """
+        Start tracking invalidations for a warm up, call it before reading the codes
+        :return: None
+        """
+        self._warm_up_invalidated = set()
+        self._warm_up_stale = False
+
+    def warm_up(self, url_cached: schemas.UrlCached) -> bool:
+        """
+        Preload a code read by the warm up into the warm map, unless it was
+        invalidated after the warm up started
+        :param url_cached: The URL read by the warm up
+        :return: Whether the code was preloaded
+        """
+        if self._warm_up_stale or url_cached.code in (self._warm_up_invalidated or ()):
+            return False
+
+        self.warm[url_cached.code] = (time.monotonic() + self.ttl_seconds, url_cached)
+
+        return True
+
+    def finish_warm_up(self) -> None:
+        self._warm_up_invalidated = None
+
+    async def shared_warm_up_codes(self, load: Callable[[], Awaitable[list[str]]]) -> list[str]:
+        """
+        Get the codes to warm up, loaded by a single worker and shared with the others
+        through Redis. The worker holding the lock runs `load` and stores its result,
+        the others wait for it. When Redis is unavailable, or the loading worker gave up,
+        the codes are loaded by the calling worker
+        :param load: Loads the codes to warm up from the database
+        :return: The codes to warm up
+        """
+        codes_key = f"{settings.cache_key_prefix}:warm-up-codes"
+        lock_key = f"{codes_key}:lock"
+
+        if not self.enabled or not self._redis_available():
+            return await load()
+
+        try:
+            value = await self.client.get(codes_key)
+
+            if value is None:
+                acquired = await self.client.set(
+                    lock_key,
+                    1,
+                    px=int(settings.cache_warmup_time_budget_seconds * 1000),
+                    nx=True,
+                )
+        except RedisError as err:
+            logging.error(f"Could not read warm up codes from cache, ex: {err}")
+            self._redis_failed(err)
+            return await load()
+
+        self._redis_succeeded()
+
+        if value is None and acquired:
+            return await self._load_warm_up_codes(load, codes_key, lock_key)
+
+        try:
+            while value is None and await self.client.exists(lock_key):
+                await asyncio.sleep(WARM_UP_CODES_POLL_SECONDS)
+                value = await self.client.get(codes_key)
+        except RedisError as err:
+            logging.error(f"Could not read warm up codes from cache, ex: {err}")
+            self._redis_failed(err)
+            return await load()
+
+        if value is None:
+            return await load()
+
+        return json.loads(value)
+
+    async def _load_warm_up_codes(
+            self,
+            load: Callable[[], Awaitable[list[str]]],
+            codes_key: str,
+            lock_key: str,
+    ) -> list[str]:
+        try:
+            codes = await load()
+
+            try:
+                await self.client.set(codes_key, json.dumps(codes), ex=settings.cache_warmup_shared_ttl_seconds)
+            except RedisError as err:
+                logging.error(f"Could not write warm up codes to cache, ex: {err}")
+                self._redis_failed(err)
+
+            return codes
+        finally:
+            # Waiting workers load the codes themselves when the lock is gone without a result
+            try:
+                await self.client.delete(lock_key)
+            except RedisError as err:
+                logging.error(f"Could not release warm up codes lock, ex: {err}")
+
+    async def acquire_fill_lock(self, url_code: str) -> tuple[bool, str | None]:
+        """
+        Try to become the only worker loading the given code from the database
+        :param url_code: The short code to load
+        :return: Tuple of whether the lock was acquired or Redis is unavailable, False if another
+        worker holds it, and the token to release the lock with, None when no lock was stored
+        """
+        if not self._redis_available():
+            return True, None
+
+        token = secrets.token_hex(16)
+
+        try:
+            acquired = await self.client.set(
+                f"{self.key_for(url_code)}:lock",
+                token,
+                px=settings.single_flight_lock_ttl_ms,
+                nx=True,
+            )
+        except RedisError as err:
+            logging.error(f"Could not acquire cache fill lock, ex: {err}")
+            self._redis_failed(err)
+            return True, None
+
+        self._redis_succeeded()
+
+        if not acquired:
+            return False, None
+
+        return True, token
+
+    async def release_fill_lock(self, url_code: str, token: str) -> None:
+        """
+        Release the fill lock of the given code, unless it expired and another worker took it
+        :param url_code: The short code that was loaded
+        :param token: The token returned by `acquire_fill_lock`
+        :return: None
+        """
+        if not self._redis_available():
+            return
+
+        try:
+            await self.client.eval(RELEASE_LOCK_SCRIPT, 1, f"{self.key_for(url_code)}:lock", token)
+        except RedisError as err:
+            logging.error(f"Could not release cache fill lock, ex: {err}")
+            self._redis_failed(err)
+        else:
+            self._redis_succeeded()
+
+    async def wait_for_fill(self, url_code: str) -> tuple[bool, schemas.UrlCached | None]:
+        """
+        Wait for the worker holding the fill lock to cache the given code
+        :param url_code: The short code to wait for
+        :return: Same as `get`, a miss if the code was not cached before the lock expired
+        """
+        poll_seconds = settings.single_flight_lock_poll_ms / 1000
+
+        for _ in range(max(1, settings.single_flight_lock_ttl_ms // settings.single_flight_lock_poll_ms)):
+            await asyncio.sleep(poll_seconds)
+            is_cached, url_cached = await self.get(url_code)
+
+            if is_cached:
+                return is_cached, url_cached
+
+        return False, None
+
+    async def invalidate(self, *url_codes: str) -> None:
+        """
+        Remove the given codes from the cache of every worker
+        :param url_codes: The short codes to remove
+        :return: None
+        """
+        if not url_codes:
+            return
+
+        self._invalidated(url_codes)
+
+        if self._redis_available():
+            try:
+                await self._publish_invalidation(url_codes)
+            except RedisError as err:
+                logging.error(
+                    f"Could not invalidate url codes {url_codes} in cache, retrying in the background, ex: {err}"
+                )
+                self._redis_failed(err)
+            else:
+                self._redis_succeeded()
+                return
+
+        self._unpublished.update(url_codes)
+
+        if self._republish_task is None or self._republish_task.done():
+            self._republish_task = asyncio.create_task(self._republish_invalidations())
+
+    async def _publish_invalidation(self, url_codes: Sequence[str]) -> None:
+        async with self.client.pipeline(transaction=False) as pipe:
+            if self.enabled:
+                pipe.delete(*(self.key_for(url_code) for url_code in url_codes))
+            pipe.publish(self.invalidation_channel, json.dumps(list(url_codes)))
+            await pipe.execute()
+
+    async def _republish_invalidations(self, max_delay_seconds: float = 30) -> None:
+        """
+        Retry the failed invalidations until Redis accepts them, with an exponential backoff.
+        Until then other workers keep stale copies and their code filters miss the new codes
+        :param max_delay_seconds: Longest wait between two attempts
+        :return: None
+        """
+        delay_seconds = 1
+
+        while self._unpublished:
+            await asyncio.sleep(delay_seconds)
+
+            if self.breaker is not None and not self.breaker.closed:
+                continue
+
+            url_codes = list(self._unpublished)
+
+            try:
+                await self._publish_invalidation(url_codes)
+            except RedisError as err:
+                logging.error(f"Could not republish {len(url_codes)} url code invalidations, ex: {err}")
+                self._redis_failed(err)
+                delay_seconds = min(delay_seconds * 2, max_delay_seconds)
+                continue
+
+            self._redis_succeeded()
+            self._unpublished.difference_update(url_codes)
+            logging.info(f"Republished {len(url_codes)} url code invalidations")
+
+    def _invalidated(self, url_codes: Sequence[str]) -> None:
+        self.local.pop(*url_codes)
+
+        for url_code in url_codes:
+            self.warm.pop(url_code, None)
+
+        if self._warm_up_invalidated is not None:
+            self._warm_up_invalidated.update(url_codes)
+
+        for listener in self.listeners:
+            listener.invalidated(url_codes)
+
+    def _resubscribed(self) -> None:
+        self.local.clear()
+        self.warm.clear()
+
+        if self._warm_up_invalidated is not None:
+            self._warm_up_stale = True
+
+        for listener in self.listeners:
+            listener.resubscribed()
+
+    async def listen_for_invalidations(self, retry_delay_seconds: float = 1) -> None:
+        """
+        Drop codes from the local cache and notify the listeners when another
+        worker invalidates them.
+
+        The local copies are cleared and the listeners are notified whenever the
+        subscription is re-established, since invalidations published while
+        disconnected are lost.
+        :param retry_delay_seconds: Seconds to wait before resubscribing after an error
+        :return: None
+        """
+        subscribed_before = False
+
+        while True:
+            try:
+                async with self.pubsub_client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.invalidation_channel)
+
+                    if subscribed_before:
+                        self._resubscribed()
+
+                    subscribed_before = True
+
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._invalidated(json.loads(message["data"]))
+            except RedisError as err:
+                logging.error(f"Lost cache invalidation subscription, ex: {err}")
+                await asyncio.sleep(retry_delay_seconds)
+
+
+url_cache = UrlCache(redis_client, LocalCache(), pubsub_client=redis_pubsub_client, breaker=redis_breaker)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from collections import Counter
+from enum import StrEnum
+from typing import Any, Awaitable, Callable
+
+from app import schemas
+
+
+class CircuitState(StrEnum):
+    # Calls go to the dependency
+    closed = "closed"
+    # Calls are short-circuited to the fallback
+    open = "open"
+    # A background probe is checking whether the dependency recovered
+    half_open = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of a dependency so callers can skip it while it is down.
+
+    The breaker opens after `failure_threshold` consecutive failures. While it
+    is not closed callers use their fallback without touching the dependency,
+    and a single background task probes it every cooldown period, so requests
+    never wait on connection timeouts. The breaker closes on the first
+    successful probe. Every state transition is logged and counted.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            probe: Callable[[], Awaitable[Any]],
+            failure_threshold: int,
+            cooldown_seconds: float,
+            probe_timeout_seconds: float,
+    ) -> None:
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_timeout_seconds = probe_timeout_seconds
+        self.state = CircuitState.closed
+        self.consecutive_failures = 0
+        self.fallback_hits = 0
+        self.transitions: Counter[str] = Counter()
+        self.on_close: list[Callable[[], None]] = []
+        self._probe_task: asyncio.Task | None = None
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CircuitState.closed
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+
+    def record_failure(self, err: BaseException) -> None:
+        """
+        Count a failed call, opening the breaker once the threshold is reached
+        :param err: The error raised by the call
+        :return: None
+        """
+        self.consecutive_failures += 1
+
+        if self.closed and self.consecutive_failures >= self.failure_threshold:
+            self._transition(CircuitState.open, f"after {self.consecutive_failures} failures, ex: {err}")
+            self._probe_task = asyncio.create_task(self._probe_until_recovered())
+
+    def _transition(self, state: CircuitState, reason: str) -> None:
+        transition = f"{self.state}->{state}"
+        level = logging.ERROR if state == CircuitState.open else logging.WARNING
+        logging.log(level, f"Circuit breaker {self.name} {transition} {reason}")
+        self.transitions[transition] += 1
+        self.state = state
+
+    async def _probe_until_recovered(self) -> None:
+        while True:
+            await asyncio.sleep(self.cooldown_seconds)
+            self._transition(CircuitState.half_open, f"to probe after {self.cooldown_seconds}s")
+
+            try:
+                async with asyncio.timeout(self.probe_timeout_seconds):
+                    await self.probe()
+            except Exception as ex:
+                self._transition(CircuitState.open, f"after a failed probe, ex: {ex!r}")
+                continue
+
+            self.consecutive_failures = 0
+            self._transition(CircuitState.closed, "after a successful probe")
+
+            for callback in self.on_close:
+                callback()
+
+            return
+
+    def stats(self) -> schemas.CircuitBreakerStats:
+        return schemas.CircuitBreakerStats(
+            state=self.state,
+            consecutive_failures=self.consecutive_failures,
+            fallback_hits=self.fallback_hits,
+            transitions=dict(self.transitions),
+        )
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from datetime import datetime, UTC
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import repositories as repo, schemas
+from app.core.config import settings
+
+
+class ClickBuffer:
+    """
+    Write-behind buffer for URL access counts.
+
+    Redirects record their click in memory and return immediately. The
+    accumulated counts are written periodically with a single bulk UPDATE,
+    so a hot link costs one row update per flush instead of one per click.
+    Clicks recorded since the last flush are lost if the worker is killed.
+
+    A failed flush keeps its clicks and the next one is retried with an
+    exponential backoff. While flushes fail, clicks of URLs beyond
+    `max_retained` are dropped and counted, so the buffer stays bounded.
+    """
+
+    def __init__(
+            self,
+            flush_interval_seconds: float = settings.click_flush_interval_seconds,
+            max_pending: int = settings.click_buffer_max_size,
+            max_retained: int = settings.click_buffer_max_retained,
+            max_retry_delay_seconds: float = settings.click_flush_max_retry_delay_seconds,
+    ) -> None:
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self.max_retained = max(max_retained, max_pending)
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+        self.failed_flushes = 0
+        self.dropped_clicks = 0
+        self._pending: dict[str, tuple[int, datetime]] = {}
+        self._flush_requested = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, url_code: str, clicks: int = 1, last_access_date: datetime | None = None) -> None:
+        """
+        Record clicks for the given URL, to be written on the next flush
+        :param url_code: The code of the URL that was accessed
+        :param clicks: Number of clicks to add
+        :param last_access_date: Time of the latest click, defaults to now
+        :return: None
+        """
+        if url_code not in self._pending and len(self._pending) >= self.max_retained:
+            self.dropped_clicks += clicks
+            return
+
+        if last_access_date is None:
+            last_access_date = datetime.now(UTC).replace(tzinfo=None)
+
+        pending_clicks, pending_date = self._pending.get(url_code, (0, last_access_date))
+        self._pending[url_code] = (pending_clicks + clicks, max(pending_date, last_access_date))
+
+        if len(self._pending) >= self.max_pending:
+            self._flush_requested.set()
+
+    async def flush(self, session_factory: async_sessionmaker[AsyncSession]) -> int:
+        """
+        Write all pending clicks to the database in one transaction.
+
+        Clicks are put back in the buffer if the write fails,
+        so they are retried on the next flush.
+        :param session_factory: Factory used to open the database session
+        :return: Number of URLs that were updated
+        """
+        self._flush_requested.clear()
+
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+
+        try:
+            async with session_factory() as session:
+                await repo.UrlShortener(session).bulk_increment_access_count(pending)
+        except asyncio.CancelledError:
+            self._restore(pending)
+            raise
+        except Exception as ex:
+            self.failed_flushes += 1
+            logging.error(
+                f"Could not flush {len(pending)} url access counts, "
+                f"retrying in {self.retry_delay_seconds():.1f}s, ex: {ex}"
+            )
+            self._restore(pending)
+            return 0
+
+        self.failed_flushes = 0
+
+        return len(pending)
+
+    def _restore(self, pending: dict[str, tuple[int, datetime]]) -> None:
+        for url_code, (clicks, last_access_date) in pending.items():
+            self.record(url_code, clicks, last_access_date)
+
+    def retry_delay_seconds(self) -> float:
+        """
+        Seconds to wait before retrying after the failed flushes so far,
+        doubling from the flush interval up to the maximum retry delay
+        :return: The delay, 0 when the last flush succeeded
+        """
+        if not self.failed_flushes:
+            return 0
+
+        # The exponent is capped so the delay can not overflow a float
+        delay = self.flush_interval_seconds * 2 ** min(self.failed_flushes - 1, 32)
+
+        return min(delay, self.max_retry_delay_seconds)
+
+    async def run(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        """
+        Flush the buffer every flush interval, or earlier when it is full.
+        After a failed flush the next one waits for the retry delay, even when the buffer is full
+        :param session_factory: Factory used to open the database session
+        :return: None
+        """
+        while True:
+            retry_delay_seconds = self.retry_delay_seconds()
+
+            if retry_delay_seconds:
+                await asyncio.sleep(retry_delay_seconds)
+            else:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval_seconds)
+                except TimeoutError:
+                    pass
+
+            await self.flush(session_factory)
+
+    def stats(self) -> schemas.ClickBufferStats:
+        return schemas.ClickBufferStats(
+            pending=len(self._pending),
+            max_pending=self.max_pending,
+            max_retained=self.max_retained,
+            failed_flushes=self.failed_flushes,
+            dropped_clicks=self.dropped_clicks,
+        )
+
+
+click_buffer = ClickBuffer()
@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import logging
+import random
+import string
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Iterable
+
+from redis import asyncio as aioredis
+from sqlalchemy import Sequence, func, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import CodeAllocatorKind, CodeIdSource, settings
+from app.core.db import engine
+from app.core.redis import redis_client
+from app.models import UrlColumnSize, url_code_sequence
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+BASE62_INDEX = {character: index for index, character in enumerate(BASE62_ALPHABET)}
+
+# Number of distinct codes of the maximum code length
+CODE_SPACE = len(BASE62_ALPHABET) ** UrlColumnSize.code.value
+
+# Codes shorter than this are left padded, same as the minimum length of generate_code
+MIN_CODE_LENGTH = 4
+
+
+def generate_code(code_length: int = UrlColumnSize.code.value) -> str:
+    """
+    Generates code for the given code length as maximum length and with minimum length of 4
+    :param code_length: The code length to generate
+    :return: The code generated
+    """
+    list_of_base_62_characters = list(string.ascii_letters + string.digits)
+    random.shuffle(list_of_base_62_characters)
+    shuffled_characters = ''.join(list_of_base_62_characters)
+    chars_length = random.randint(MIN_CODE_LENGTH, code_length)
+
+    return ''.join(random.choices(shuffled_characters, k=chars_length))
+
+
+def encode_base62(number: int, min_length: int = 0) -> str:
+    """
+    Encode a non-negative integer in base62
+    :param number: The integer to encode
+    :param min_length: Left pad the code with zeros up to this length
+    :return: The base62 code
+    """
+    if number < 0:
+        raise ValueError(f"Can not encode negative number {number} in base62")
+
+    characters = []
+
+    while number:
+        number, remainder = divmod(number, 62)
+        characters.append(BASE62_ALPHABET[remainder])
+
+    return ''.join(reversed(characters)).rjust(max(min_length, 1), BASE62_ALPHABET[0])
+
+
+def decode_base62(code: str) -> int:
+    """
+    Decode a base62 code back to its integer
+    :param code: The base62 code
+    :return: The decoded integer
+    """
+    number = 0
+
+    for character in code:
+        number = number * 62 + BASE62_INDEX[character]
+
+    return number
+
+
+class FeistelPermutation:
+    """
+    Keyed bijection on the integers in [0, CODE_SPACE).
+
+    A balanced Feistel network permutes 48 bit integers and cycle walking
+    keeps the result inside the code space, so sequential ids map to codes
+    that look random and can not be enumerated without the key.
+    """
+
+    HALF_BITS = 24
+    HALF_MASK = (1 << HALF_BITS) - 1
+
+    def __init__(self, key: str, rounds: int = 4) -> None:
+        if CODE_SPACE > 1 << (2 * self.HALF_BITS):
+            raise ValueError("Code space does not fit in the Feistel block size")
+
+        self.round_keys = [
+            hashlib.blake2b(f"{index}:{key}".encode(), digest_size=16).digest()
+            for index in range(rounds)
+        ]
+
+    def _round(self, half: int, round_key: bytes) -> int:
+        digest = hashlib.blake2b(half.to_bytes(3, "big"), key=round_key, digest_size=3).digest()
+        return int.from_bytes(digest, "big")
+
+    def _permute(self, number: int, round_keys: list[bytes]) -> int:
+        left, right = number >> self.HALF_BITS, number & self.HALF_MASK
+
+        for round_key in round_keys:
+            left, right = right, left ^ self._round(right, round_key)
+
+        return (right << self.HALF_BITS) | left
+
+    def _walk(self, number: int, round_keys: list[bytes]) -> int:
+        if not 0 <= number < CODE_SPACE:
+            raise ValueError(f"{number} is outside of the code space")
+
+        number = self._permute(number, round_keys)
+
+        while number >= CODE_SPACE:
+            number = self._permute(number, round_keys)
+
+        return number
+
+    def encode(self, number: int) -> int:
+        return self._walk(number, self.round_keys)
+
+    def decode(self, number: int) -> int:
+        return self._walk(number, self.round_keys[::-1])
+
+
+class IdBlockSource(ABC):
+    """Hands out blocks of ids that are unique across all workers and nodes."""
+
+    @abstractmethod
+    async def lease(self, size: int) -> Iterable[int]:
+        """
+        Lease a block of unique ids
+        :param size: Number of ids to lease
+        :return: The leased ids
+        """
+
+
+class RedisIdBlocks(IdBlockSource):
+    """
+    Leases ids by advancing an atomic Redis counter with INCRBY.
+
+    When the counter does not exist yet it starts from the value of the
+    legacy key, if any, so ids handed out under the old key are not reused.
+    """
+
+    def __init__(self, client: aioredis.Redis, key: str, legacy_key: str | None = None) -> None:
+        self.client = client
+        self.key = key
+        self.legacy_key = legacy_key
+        self._migrated = legacy_key is None
+
+    async def lease(self, size: int) -> Iterable[int]:
+        if not self._migrated:
+            await self._migrate_legacy_key()
+
+        last_id = await self.client.incrby(self.key, size)
+        return range(last_id - size + 1, last_id + 1)
+
+    async def _migrate_legacy_key(self) -> None:
+        legacy_value = await self.client.get(self.legacy_key)
+
+        if legacy_value is not None:
+            try:
+                last_id = int(legacy_value)
+            except ValueError:
+                logging.error(f"Legacy code id counter {self.legacy_key} holds {legacy_value!r}, it is not migrated")
+            else:
+                # Only the first worker sets it, a counter that already exists is kept
+                await self.client.set(self.key, last_id, nx=True)
+
+        self._migrated = True
+
+
+class PostgresSequenceIdBlocks(IdBlockSource):
+    """Leases ids from a Postgres sequence in a single query."""
+
+    def __init__(self, db_engine: AsyncEngine, sequence: Sequence) -> None:
+        self.db_engine = db_engine
+        self.sequence = sequence
+
+    async def lease(self, size: int) -> Iterable[int]:
+        statement = select(self.sequence.next_value()).select_from(func.generate_series(1, size))
+
+        async with self.db_engine.connect() as connection:
+            return (await connection.scalars(statement)).all()
+
+
+class LeasedIdSource:
+    """
+    Worker local pool of ids leased in blocks.
+
+    Ids are handed out from memory and a new block is leased in the
+    background once the pool runs low, so allocating an id only waits
+    for the database or Redis when the pool is empty. Ids left unused
+    when a worker stops are lost, which leaves gaps but never duplicates.
+    """
+
+    def __init__(
+            self,
+            blocks: IdBlockSource,
+            block_size: int = settings.code_id_block_size,
+            refill_threshold: float = settings.code_id_refill_threshold,
+    ) -> None:
+        self.blocks = blocks
+        self.block_size = block_size
+        self.low_watermark = int(block_size * refill_threshold)
+        self._ids: deque[int] = deque()
+        self._refill_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    async def __call__(self) -> int:
+        if len(self._ids) <= self.low_watermark:
+            self.prefetch()
+
+        while not self._ids:
+            await asyncio.shield(self.prefetch())
+
+        return self._ids.popleft()
+
+    def prefetch(self) -> asyncio.Task:
+        """
+        Start leasing a new block in the background unless a lease is in progress
+        :return: The task leasing the block
+        """
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+            self._refill_task.add_done_callback(self._log_refill_error)
+
+        return self._refill_task
+
+    async def _refill(self) -> None:
+        self._ids.extend(await self.blocks.lease(self.block_size))
+
+    @staticmethod
+    def _log_refill_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Could not lease a block of code ids, ex: {task.exception()}")
+
+
+class CodeAllocator(ABC):
+    """Allocates short codes for new URLs."""
+
+    def prefetch(self) -> None:
+        """Prepare upcoming allocations in the background."""
+
+    @abstractmethod
+    async def allocate(self) -> str:
+        """
+        Allocate a new short code
+        :return: The allocated code
+        """
+
+
+class RandomCodeAllocator(CodeAllocator):
+    """
+    Allocates random codes with `generate_code`.
+
+    Uniqueness is only enforced by the unique constraint on `Url.code`,
+    so callers have to retry on a conflicting insert.
+    """
+
+    async def allocate(self) -> str:
+        return generate_code()
+
+
+class CounterCodeAllocator(CodeAllocator):
+    """
+    Allocates codes by encoding unique ids from a counter in base62.
+
+    Every id is handed out once, so codes never collide with each other
+    and no lookup is needed before inserting. When a permutation is given
+    the ids are obfuscated first and all codes have the maximum code length.
+    """
+
+    def __init__(
+            self,
+            ids: LeasedIdSource,
+            permutation: FeistelPermutation | None = None,
+    ) -> None:
+        self.ids = ids
+        self.permutation = permutation
+
+    def prefetch(self) -> None:
+        self.ids.prefetch()
+
+    def code_for(self, number: int) -> str:
+        """
+        Encode the given id as a short code
+        :param number: The unique id
+        :return: The short code for the id
+        """
+        if self.permutation is None:
+            return encode_base62(number, MIN_CODE_LENGTH)
+
+        return encode_base62(self.permutation.encode(number), UrlColumnSize.code.value)
+
+    async def allocate(self) -> str:
+        return self.code_for(await self.ids())
+
+
+def get_code_allocator() -> CodeAllocator:
+    """
+    Create the code allocator configured in the settings
+    :return: The code allocator
+    """
+    if settings.code_allocator is CodeAllocatorKind.random:
+        return RandomCodeAllocator()
+
+    permutation = None
+
+    if settings.code_obfuscation_key:
+        permutation = FeistelPermutation(settings.code_obfuscation_key)
+    else:
+        logging.warning("CODE_OBFUSCATION_KEY is not set, counter based codes are sequential and enumerable")
+
+    if settings.code_id_source is CodeIdSource.redis:
+        # Kept out of the code:<code> namespace of the cache, a URL with the code
+        # "counter" would otherwise invalidate or overwrite it
+        blocks = RedisIdBlocks(
+            redis_client,
+            f"{settings.cache_key_prefix}:code-id-counter",
+            legacy_key=f"{settings.cache_key_prefix}:code:counter",
+        )
+    else:
+        blocks = PostgresSequenceIdBlocks(engine, url_code_sequence)
+
+    return CounterCodeAllocator(
+        ids=LeasedIdSource(blocks),
+        permutation=permutation,
+    )
+
+
+code_allocator = get_code_allocator()
@@ -1,26 +1,209 @@
-from collections.abc import AsyncGenerator
+import logging
+import time
+from collections.abc import AsyncGenerator, Sequence
+from typing import Any
 
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, exc
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app import schemas
 from app.core.config import settings
 
-engine = create_async_engine(settings.db_url.human_repr(), echo=settings.db_echo, future=True)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool that measures how long checkouts wait for a free connection."""
+
+    checkouts = 0
+    timeouts = 0
+    wait_seconds_total = 0.0
+    wait_seconds_max = 0.0
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            InstrumentedQueuePool.timeouts += 1
+            raise
+        finally:
+            wait_seconds = time.perf_counter() - start
+            InstrumentedQueuePool.checkouts += 1
+            InstrumentedQueuePool.wait_seconds_total += wait_seconds
+            InstrumentedQueuePool.wait_seconds_max = max(InstrumentedQueuePool.wait_seconds_max, wait_seconds)
+
+    def stats(self) -> schemas.DbPoolStats:
+        return schemas.DbPoolStats(
+            size=self.size(),
+            checked_out=self.checkedout(),
+            checked_in=self.checkedin(),
+            overflow=self.overflow(),
+            max_overflow=self._max_overflow,
+            checkouts=self.checkouts,
+            timeouts=self.timeouts,
+            wait_seconds_total=self.wait_seconds_total,
+            wait_seconds_max=self.wait_seconds_max,
+        )
+
+
+engine = create_async_engine(
+    settings.db_url.human_repr(),
+    echo=settings.db_echo,
+    future=True,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout_seconds,
+    pool_recycle=settings.db_pool_recycle_seconds,
+    pool_pre_ping=settings.db_pool_pre_ping,
+)
 meta = MetaData(schema=settings.db_schema)
+session_factory = async_sessionmaker(
+    engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+class Replica:
+    """A read replica engine and the time until which it is skipped."""
+
+    def __init__(self, url: str) -> None:
+        self.engine = create_async_engine(
+            url,
+            echo=settings.db_echo,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout_seconds,
+            pool_recycle=settings.db_pool_recycle_seconds,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+        self.session_factory = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.ejected_until = 0.0
+
+
+class ReplicaRouter:
+    """
+    Round-robin over the read replicas, skipping unhealthy ones.
+
+    A replica that fails with a connection error is ejected for
+    `ejection_seconds` and tried again afterwards. Codes written by any worker
+    arrive through cache invalidations and their reads stay on the primary for
+    `read_your_writes_seconds`, so a code is readable right after it is created
+    even if the replicas lag behind. After missed invalidations every read goes
+    to the primary for the same period.
+    """
+
+    def __init__(
+            self,
+            urls: Sequence[str] = settings.db_replica_urls,
+            ejection_seconds: float = settings.db_replica_ejection_seconds,
+            read_your_writes_seconds: float = settings.db_replica_read_your_writes_seconds,
+    ) -> None:
+        self.replicas = [Replica(url) for url in urls]
+        self.ejection_seconds = ejection_seconds
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._next_index = 0
+        self._recent_writes: dict[str, float] = {}
+        self._primary_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def replica_for(self, url_code: str | None = None) -> Replica | None:
+        """
+        Pick the next healthy replica for a read
+        :param url_code: The code the read is for, if any
+        :return: The replica to read from or None to read from the primary
+        """
+        now = time.monotonic()
+
+        if not self.replicas or now < self._primary_until:
+            return None
+
+        if url_code is not None and self._recent_writes.get(url_code, 0) > now:
+            return None
+
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next_index]
+            self._next_index = (self._next_index + 1) % len(self.replicas)
+
+            if replica.ejected_until <= now:
+                return replica
+
+        return None
+
+    def eject(self, replica: Replica, err: Exception) -> None:
+        replica.ejected_until = time.monotonic() + self.ejection_seconds
+        logging.error(f"Ejected read replica {replica.name} for {self.ejection_seconds}s, ex: {err}")
+
+    def invalidated(self, url_codes: Sequence[str]) -> None:
+        now = time.monotonic()
+        expires_at = now + self.read_your_writes_seconds
+
+        # Entries are added in time order, so expired ones are at the start
+        while self._recent_writes:
+            url_code, written_until = next(iter(self._recent_writes.items()))
+
+            if written_until > now:
+                break
+
+            del self._recent_writes[url_code]
+
+        for url_code in url_codes:
+            self._recent_writes.pop(url_code, None)
+            self._recent_writes[url_code] = expires_at
+
+    def resubscribed(self) -> None:
+        self._primary_until = time.monotonic() + self.read_your_writes_seconds
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+replica_router = ReplicaRouter()
+
+
+class LazySession:
+    """
+    Stand-in for an `AsyncSession` that creates it on first use.
+
+    Requests answered without the database, such as redirects of cached
+    codes, never create a session. The session itself only checks out a
+    connection from the pool when it runs its first statement.
+    """
+
+    def __init__(self, factory: async_sessionmaker[AsyncSession]) -> None:
+        self._factory = factory
+        self._session: AsyncSession | None = None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._factory()
+
+        return self._session
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.session, name)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
 
 
 async def get_session() -> AsyncGenerator:
-    async_session_factory = async_sessionmaker(
-        autocommit=False,
-        autoflush=False,
-        expire_on_commit=False,
-        bind=engine,
-        class_=AsyncSession,
-    )
-
-    async with async_session_factory() as session:
+    session = LazySession(session_factory)
+
+    try:
         yield session
+    finally:
+        await session.close()
@@ -1,15 +1,22 @@
-import json
+import glob
+import gzip
 import logging
 import os
+import queue
 import shutil
 import sys
+import threading
 from datetime import datetime, UTC
-from typing import Union
+from typing import BinaryIO, Union
 
+import orjson
 from loguru import logger
 
 from app.core.config import settings
 
+LOGS_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs")
+LOG_FILENAME = "log.jsonl"
+
 LOG_RECORD_DEFAULT_PARAMS = {
     "args",
     "asctime",
@@ -38,47 +45,231 @@ LOG_RECORD_DEFAULT_PARAMS = {
 }
 
 
-def write_log_to_file(message: dict, logs_directory: str, filename: str) -> None:
+def encode_log(message: dict) -> bytes:
+    """
+    Encode a log message as one JSON line
+    :param message: Log message to be encoded
+    :return: The encoded line
     """
-    Write logs to the specified directory and file name
-    :param message: Log message to be written
-    :param logs_directory: Directory for the logs folder
-    :param filename: Name of the log file
+    return orjson.dumps(message, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def compress_log_segment(segment_path: str, max_backups: int) -> None:
+    """
+    Compress a rotated log segment and delete the oldest compressed segments
+    that are more than the defined max backups
+    :param segment_path: Path of the rotated segment
+    :param max_backups: Number of compressed segments to keep next to the log file
     :return: None
     """
-    if not os.path.exists(logs_directory):
-        os.mkdir(logs_directory)
+    compressed_path = f"{segment_path}.gz"
+    temporary_path = f"{compressed_path}.tmp"
+
+    with open(segment_path, 'rb') as source, gzip.open(temporary_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+
+    os.replace(temporary_path, compressed_path)
+    os.remove(segment_path)
 
-    with open(os.path.join(logs_directory, filename), 'a') as f:
-        f.write(json.dumps(message) + '\n')
+    log_file_path = segment_path.rsplit(".", 1)[0]
+    # Segment names end with their rotation time, so they sort from oldest to newest
+    backups = sorted(glob.glob(f"{glob.escape(log_file_path)}.*.gz"))
 
+    for old_backup in backups[:max(0, len(backups) - max_backups)]:
+        os.remove(old_backup)
 
-def create_backup(
-        logs_directory: str,
-        filename: str,
-        max_size_in_mb: int = 10,
-        max_backups: int = 3
-) -> None:
+
+class LogWriter:
     """
-    Create backup after the log file reached a defined size and delete the files
-    that are more the defined max backup
-    :param logs_directory: Directory for the logs folder
-    :param filename: Name of the log file
-    :param max_size_in_mb: Size in megabytes for each log file
-    :param max_backups: Number of max backups that can exist in logs folder
-    :return: None
+    Writes detailed log records to the log file from a background thread.
+
+    Records are put on a bounded queue and never block the caller. The thread
+    writes them in batches with one write per batch, so the event loop does no
+    file I/O or JSON encoding for logging. When the queue is full new records
+    are dropped and counted, and the count is written as a record of its own
+    once there is room again. `stop` writes everything still queued.
+
+    The log file is kept open and its size is read from the file position after
+    every batch, so the cost per batch does not depend on the file size. Once the
+    size is crossed the file is renamed atomically to a timestamped segment and
+    reopened, and the segment is compressed and old segments pruned in another
+    thread. Workers reopen the file when another worker rotated it.
     """
-    file_full_path = os.path.join(logs_directory, filename)
-    file_size = os.path.getsize(file_full_path) / (1024 * 1024)
 
-    if file_size > max_size_in_mb:
-        date_now = datetime.now(UTC).replace(tzinfo=None)
-        backup_filename = f"{file_full_path}_{date_now.strftime('%Y%m%d_%H%M%S')}.bak"
-        shutil.copy(file_full_path, backup_filename)
-        backups = sorted(filter(lambda x: file_full_path in x, os.listdir()), key=os.path.getmtime, reverse=True)
+    def __init__(
+            self,
+            logs_directory: str = LOGS_DIRECTORY,
+            filename: str = LOG_FILENAME,
+            max_queue_size: int = settings.log_queue_max_size,
+            batch_size: int = settings.log_batch_size,
+            flush_interval_seconds: float = settings.log_flush_interval_seconds,
+            max_size_in_mb: float = settings.log_max_size_in_mb,
+            max_backups: int = settings.log_max_backups,
+    ) -> None:
+        self.logs_directory = logs_directory
+        self.filename = filename
+        self.max_size_bytes = int(max_size_in_mb * 1024 * 1024)
+        self.max_backups = max_backups
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.dropped = 0
+        # Records are dropped by any logging thread and reported by the writer thread
+        self._dropped_lock = threading.Lock()
+        self._queue: queue.Queue[dict | None] = queue.Queue(maxsize=max_queue_size)
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self._file: BinaryIO | None = None
+        self._compressions: list[threading.Thread] = []
+
+    def put(self, message: dict) -> None:
+        """
+        Queue a log message to be written, dropping it if the queue is full
+        :param message: Log message to be written
+        :return: None
+        """
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive a fork, so each process starts its own writer
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._dropped_lock = threading.Lock()
+                self.dropped = 0
+                self._file = None
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _next_batch(self) -> tuple[list[dict], bool]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval_seconds)]
+        except queue.Empty:
+            return [], False
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        stopped = None in batch
+
+        return [message for message in batch if message is not None], stopped
+
+    def _run(self) -> None:
+        stopped = False
+
+        while not stopped:
+            batch, stopped = self._next_batch()
+
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+
+            if dropped:
+                batch.append({
+                    "level": logging.getLevelName(logging.WARNING),
+                    "message": f"Dropped {dropped} log records, the log queue was full",
+                    "timestamp": str(datetime.now(UTC)),
+                    "logger": __name__,
+                })
+
+            if not batch:
+                continue
+
+            try:
+                self._write(batch)
+            except Exception as ex:
+                print(f"Could not write {len(batch)} log records, ex: {ex}", file=sys.stderr)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.logs_directory, self.filename)
+
+    def _is_current(self) -> bool:
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _write(self, batch: list[dict]) -> None:
+        # Reopen when closed or when another worker rotated the file
+        if self._file is None or self._file.closed or not self._is_current():
+            if self._file is not None:
+                self._file.close()
+
+            os.makedirs(self.logs_directory, exist_ok=True)
+            self._file = open(self.path, 'ab')
+
+        self._file.write(b"".join(encode_log(message) for message in batch))
+        self._file.flush()
+
+        # Appends always land at the end, so the position is the file size
+        # including what other workers wrote
+        if self._file.tell() >= self.max_size_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        segment_path = f"{self.path}.{datetime.now(UTC).strftime('%Y%m%d_%H%M%S_%f')}"
+
+        try:
+            os.replace(self.path, segment_path)
+        except FileNotFoundError:
+            # Another worker rotated the file first
+            return
+
+        self._compressions = [thread for thread in self._compressions if thread.is_alive()]
+        thread = threading.Thread(
+            target=self._compress,
+            args=(segment_path,),
+            name="log-compressor",
+            daemon=True,
+        )
+        thread.start()
+        self._compressions.append(thread)
+
+    def _compress(self, segment_path: str) -> None:
+        try:
+            compress_log_segment(segment_path, self.max_backups)
+        except Exception as ex:
+            print(f"Could not compress log segment {segment_path}, ex: {ex}", file=sys.stderr)
+
+    def stop(self, timeout_seconds: float = 5) -> None:
+        """
+        Write the queued records and stop the writer thread
+        :param timeout_seconds: Seconds to wait for the queue to be written
+        :return: None
+        """
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+
+        try:
+            self._queue.put(None, timeout=timeout_seconds)
+        except queue.Full:
+            return
+
+        self._thread.join(timeout_seconds)
+        self._pid = None
+
+        if self._file is not None:
+            self._file.close()
+
+        for thread in self._compressions:
+            thread.join(timeout_seconds)
+
 
-        for old_backup in backups[max_backups:]:
-            os.remove(old_backup)
+log_writer = LogWriter()
 
 
 class InterceptHandler(logging.Handler):
@@ -131,10 +322,7 @@ class InterceptHandler(logging.Handler):
                     if key not in LOG_RECORD_DEFAULT_PARAMS
                 }
             }
-            logs_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs")
-            filename = "log.jsonl"
-            write_log_to_file(detailed_log, logs_directory, filename)
-            create_backup(logs_directory, filename)
+            log_writer.put(detailed_log)
 
 
 def configure_logging() -> None:
@@ -1,17 +1,134 @@
+import asyncio
+import hashlib
 import logging
+import time
 from typing import Callable, Awaitable, Any, Annotated
 
 from fastapi import Header
-from limits import RateLimitItem, RateLimitItemPerMinute, storage, strategies
+from limits import RateLimitItem, RateLimitItemPerMinute
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 from starlette.requests import Request
 
 from app.core import exceptions as app_exceptions
 from app.core import responses as app_responses
-from app.core.config import settings
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import RateLimitStrategy, settings
+from app.core.redis import redis_breaker, redis_client
 from app.deps import get_client_ip
 
-storage = storage.RedisStorage(str(settings.redis_url))
-throttler = strategies.MovingWindowRateLimiter(storage)
+# Moving window kept as a list of the latest request timestamps, newest first.
+# Same algorithm as the moving window of `limits`, ran atomically in one round-trip.
+MOVING_WINDOW_SCRIPT = """
+local timestamp = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local expiry = tonumber(ARGV[3])
+local amount = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+
+if amount > limit then
+    return 0
+end
+
+local entry = redis.call('lindex', KEYS[1], limit - amount)
+
+if entry and tonumber(entry) >= timestamp - expiry then
+    return 0
+end
+
+for i = 1, amount do
+    redis.call('lpush', KEYS[1], timestamp)
+end
+
+redis.call('ltrim', KEYS[1], 0, limit - 1)
+redis.call('expire', KEYS[1], ttl)
+
+return 1
+"""
+
+# Sliding window counter kept as a hash of the current window index, its count and
+# the count of the previous window. The previous count is weighted by the part of the
+# previous window still inside the sliding window, so memory per key is constant at the
+# cost of assuming the previous window's requests were evenly spread. Bursts at the end
+# of the previous window are undercounted and at its start overcounted, by at most the
+# previous window's count times the weight.
+SLIDING_WINDOW_COUNTER_SCRIPT = """
+local timestamp = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local expiry = tonumber(ARGV[3])
+local amount = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+
+if amount > limit then
+    return 0
+end
+
+local window = math.floor(timestamp / expiry)
+local state = redis.call('hmget', KEYS[1], 'window', 'current', 'previous')
+local stored_window = tonumber(state[1])
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+
+if stored_window == window - 1 then
+    previous = current
+    current = 0
+elseif stored_window ~= window then
+    previous = 0
+    current = 0
+end
+
+local weight = 1 - (timestamp - window * expiry) / expiry
+
+if previous * weight + current + amount > limit then
+    return 0
+end
+
+redis.call('hset', KEYS[1], 'window', window, 'current', current + amount, 'previous', previous)
+redis.call('expire', KEYS[1], ttl)
+
+return 1
+"""
+
+# Adds the requests a worker allowed locally to the same sliding window counter
+# and returns the estimated requests of every worker in the sliding window.
+RECONCILE_SCRIPT = """
+local timestamp = tonumber(ARGV[1])
+local expiry = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+
+local window = math.floor(timestamp / expiry)
+local state = redis.call('hmget', KEYS[1], 'window', 'current', 'previous')
+local stored_window = tonumber(state[1])
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+
+if stored_window == window - 1 then
+    previous = current
+    current = 0
+elseif stored_window ~= window then
+    previous = 0
+    current = 0
+end
+
+current = current + amount
+redis.call('hset', KEYS[1], 'window', window, 'current', current, 'previous', previous)
+redis.call('expire', KEYS[1], ttl)
+
+return tostring(previous * (1 - (timestamp - window * expiry) / expiry) + current)
+"""
+
+# Number of windows a key has to outlive its last request for the strategy to stay accurate
+WINDOWS_KEPT = {
+    RateLimitStrategy.moving_window: 1,
+    RateLimitStrategy.sliding_window_counter: 2,
+    RateLimitStrategy.local_token_bucket: 2,
+}
+
+rate_limit_scripts = {
+    RateLimitStrategy.moving_window: redis_client.register_script(MOVING_WINDOW_SCRIPT),
+    RateLimitStrategy.sliding_window_counter: redis_client.register_script(SLIDING_WINDOW_COUNTER_SCRIPT),
+}
 
 
 def rate_limit_item_for(rate_per_minute: int) -> RateLimitItem:
@@ -25,27 +142,230 @@ def rate_limit_item_for(rate_per_minute: int) -> RateLimitItem:
     return RateLimitItemPerMinute(rate_per_minute)
 
 
-def hit(key: str, rate_per_minute: int, cost: int = 1) -> bool:
+class TokenBucket:
+    """Tokens a worker can still spend on one key, refilled continuously over the window."""
+
+    def __init__(self, redis_key: str, item: RateLimitItem, ttl: int) -> None:
+        self.redis_key = redis_key
+        self.limit = item.amount
+        self.expiry = item.get_expiry()
+        self.ttl = ttl
+        self.tokens = float(item.amount)
+        self.updated_at = time.monotonic()
+        # Tokens spent since the last reconciliation
+        self.pending = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.limit, self.tokens + (now - self.updated_at) * self.limit / self.expiry)
+        self.updated_at = now
+
+
+class LocalTokenBuckets:
+    """
+    Worker local token buckets reconciled with Redis in the background.
+
+    Requests only take tokens from the worker's bucket for their key, without
+    any network call. Every sync interval the tokens spent since the last sync
+    are added to the key's sliding window counter in Redis in one pipeline, and
+    each bucket is capped to what is left of the global limit. Workers converge
+    on the global limit one interval late, so it can be exceeded by what the
+    other workers allowed in that interval. Buckets of idle keys are dropped
+    after their TTL.
+    """
+
+    def __init__(
+            self,
+            client: aioredis.Redis,
+            breaker: CircuitBreaker | None = None,
+            sync_interval_ms: int = settings.rate_limit_sync_interval_ms,
+    ) -> None:
+        self.client = client
+        self.breaker = breaker
+        self.sync_interval_seconds = sync_interval_ms / 1000
+        self._reconcile = client.register_script(RECONCILE_SCRIPT)
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def hit(self, redis_key: str, item: RateLimitItem, cost: int, ttl: int) -> bool:
+        """
+        Take tokens from the local bucket of the key
+        :param redis_key: the key the bucket is reconciled with
+        :param item: the rate limit of the key
+        :param cost: the number of tokens to take
+        :param ttl: seconds the key is kept after its last request
+        :return: `true` if the bucket had enough tokens
+        """
+        bucket = self._buckets.get(redis_key)
+
+        if bucket is None:
+            bucket = self._buckets[redis_key] = TokenBucket(redis_key, item, ttl)
+
+        bucket.refill(time.monotonic())
+
+        if bucket.tokens < cost:
+            return False
+
+        bucket.tokens -= cost
+        bucket.pending += cost
+
+        return True
+
+    async def sync(self) -> None:
+        """
+        Send the tokens spent since the last sync to Redis and cap the buckets to the global limit,
+        spent tokens are kept for the next sync if Redis fails
+        :return: None
+        """
+        now = time.monotonic()
+        buckets = []
+
+        for redis_key, bucket in list(self._buckets.items()):
+            if bucket.pending:
+                buckets.append(bucket)
+            elif now - bucket.updated_at > bucket.ttl:
+                del self._buckets[redis_key]
+
+        if not buckets:
+            return
+
+        pending = [bucket.pending for bucket in buckets]
+
+        for bucket in buckets:
+            bucket.pending = 0
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for bucket, spent in zip(buckets, pending):
+                    await self._reconcile(
+                        keys=[bucket.redis_key],
+                        args=[time.time(), bucket.expiry, spent, bucket.ttl],
+                        client=pipe,
+                    )
+
+                estimates = await pipe.execute()
+        except BaseException:
+            for bucket, spent in zip(buckets, pending):
+                bucket.pending += spent
+            raise
+
+        now = time.monotonic()
+
+        for bucket, estimate in zip(buckets, estimates):
+            bucket.refill(now)
+            bucket.tokens = min(bucket.tokens, max(0.0, bucket.limit - float(estimate)))
+
+    async def run(self) -> None:
+        """
+        Reconcile the buckets with Redis every sync interval, skipped while the breaker is open
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval_seconds)
+
+            if self.breaker is not None and not self.breaker.closed:
+                continue
+
+            try:
+                await self.sync()
+            except (RedisError, OSError) as err:
+                logging.error(f"Could not reconcile rate limit buckets with redis, ex: {err}")
+
+                if self.breaker is not None:
+                    self.breaker.record_failure(err)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+
+
+local_token_buckets = LocalTokenBuckets(redis_client, redis_breaker)
+# Per worker limits used while Redis is unavailable, never reconciled
+fallback_token_buckets = LocalTokenBuckets(redis_client)
+redis_breaker.on_close.append(fallback_token_buckets.clear)
+
+
+def key_ttl_for(item: RateLimitItem, strategy: RateLimitStrategy) -> int:
+    """
+    Seconds a rate limit key is kept after the last request of its client
+    :param item: the rate limit of the key
+    :param strategy: how the requests in the time window are counted
+    :return: the configured TTL, raised to the windows the strategy needs
+    """
+
+    return max(settings.rate_limit_key_ttl_seconds, item.get_expiry() * WINDOWS_KEPT[strategy])
+
+
+async def hit(
+        key: str,
+        rate_per_minute: int,
+        cost: int = 1,
+        strategy: RateLimitStrategy = settings.rate_limit_strategy,
+) -> bool:
     """
         Hits the throttler and returns `true` if a request can be passed and `false` if it needs to be blocked
         :param key: the key that identifies the client that needs to be throttled
         :param rate_per_minute: the number of request per minute to allow
         :param cost: the cost of the request in the time window.
+        :param strategy: how the requests in the time window are counted
         :return: returns `true` if a request can be passed and `false` if it needs to be blocked
     """
 
     item = rate_limit_item_for(rate_per_minute=rate_per_minute)
-    is_hit = throttler.hit(item, key, cost=cost)
-    return is_hit
+    redis_key = item.key_for(key)
+
+    if strategy != RateLimitStrategy.moving_window:
+        redis_key = f"{redis_key}/{strategy}"
+
+    if strategy == RateLimitStrategy.local_token_bucket:
+        return local_token_buckets.hit(redis_key, item, cost, key_ttl_for(item, strategy))
+
+    if redis_breaker.closed:
+        try:
+            is_hit = await rate_limit_scripts[strategy](
+                keys=[redis_key],
+                args=[time.time(), item.amount, item.get_expiry(), cost, key_ttl_for(item, strategy)],
+            )
+        except (RedisError, OSError) as err:
+            redis_breaker.record_failure(err)
+        else:
+            redis_breaker.record_success()
+            return bool(is_hit)
+
+    redis_breaker.fallback_hits += 1
+    return fallback_token_buckets.hit(redis_key, item, cost, key_ttl_for(item, strategy))
+
+
+def route_template(request: Request) -> str:
+    """
+    Path template of the route that matched the request, so `/abc` and `/xyz`
+    share the key of `/{url_code}`
+    :param request: the request to identify
+    :return: the route template or the raw path if no route matched
+    """
+
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or request.url.path
 
 
 async def identifier(
         request: Request,
         client_ip: Annotated[str | None, Header(default=None, alias="X-Real-IP")] = None
 ) -> str:
-    ip = get_client_ip(request=request, client_ip=client_ip)
-    path = request.url.path
-    return f"{ip}{path}"
+    ip = get_client_ip(request=request, client_ip=client_ip or request.headers.get("X-Real-IP"))
+    key = f"{ip}{route_template(request)}"
+
+    # Header values can be secrets such as API keys, only their digest is stored
+    for header in settings.rate_limit_key_headers:
+        value = request.headers.get(header)
+
+        if value is not None:
+            key += f"/{header.lower()}:{hashlib.blake2b(value.encode(), digest_size=8).hexdigest()}"
+
+    return key
 
 
 async def _default_callback(request: Request):
@@ -58,17 +378,22 @@ class RateLimitMinuteMiddleware:
             callback: Callable[[Request], Awaitable[Any]] = _default_callback,
             rate_identifier: Callable[[Request], Awaitable[str]] = identifier,
             request_per_minute: int = 1,
+            strategy: RateLimitStrategy = settings.rate_limit_strategy,
     ):
         self.rate_identifier = rate_identifier
         self.callback = callback
         self.rate = request_per_minute
+        self.strategy = strategy
 
     async def __call__(self, request: Request):
+        if not settings.rate_limit_enabled:
+            return
+
         key = await self.rate_identifier(request)
         try:
-            if not hit(key=key, rate_per_minute=self.rate):
+            if not await hit(key=key, rate_per_minute=self.rate, strategy=self.strategy):
                 return await self.callback(request)
-        except ConnectionError as err:
+        except (ConnectionError, RedisError) as err:
             logging.error(f"Can not connect to redis, ex: {err}")
             raise app_exceptions.InternalServerErrorException("Internal server error")
         except app_exceptions.TooManyRequestsException as ex:
@@ -0,0 +1,26 @@
+from redis import asyncio as aioredis
+
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import settings
+
+redis_client = aioredis.from_url(
+    str(settings.redis_url),
+    decode_responses=True,
+    socket_connect_timeout=settings.redis_socket_connect_timeout_seconds,
+    socket_timeout=settings.redis_socket_timeout_seconds,
+)
+# Subscriptions wait on reads until a message is published, so only connecting is bounded
+redis_pubsub_client = aioredis.from_url(
+    str(settings.redis_url),
+    decode_responses=True,
+    socket_connect_timeout=settings.redis_socket_connect_timeout_seconds,
+)
+# Shared by the rate limiter and the cache, so requests skip Redis while it is down
+# instead of waiting out the socket timeouts
+redis_breaker = CircuitBreaker(
+    name="redis",
+    probe=redis_client.ping,
+    failure_threshold=settings.rate_limit_breaker_failure_threshold,
+    cooldown_seconds=settings.rate_limit_breaker_cooldown_seconds,
+    probe_timeout_seconds=settings.rate_limit_breaker_probe_timeout_seconds,
+)
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Callable, TypeVar
+
+from app import schemas
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one.
+
+    The first caller for a key starts the call in its own task and every
+    caller arriving while it runs awaits the same task, so a burst of
+    lookups for one key costs a single query. The task is shielded, so a
+    cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run the call unless a call with the same key is in flight, then share its result
+        :param key: The key that identifies the call
+        :param call: The call to run
+        :return: The result of the call
+        """
+        task = self._calls.get(key)
+
+        if task is None:
+            self.calls += 1
+            task = asyncio.create_task(call())
+            task.add_done_callback(lambda done_task: self._done(key, done_task))
+            self._calls[key] = task
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task[Any]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+        # Mark the exception as retrieved when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> schemas.SingleFlightStats:
+        return schemas.SingleFlightStats(
+            in_flight=len(self._calls),
+            calls=self.calls,
+            coalesced=self.coalesced,
+        )
+
+
+code_lookups = SingleFlight()
@@ -1,22 +1,29 @@
+import hashlib
 import logging
-import random
 import re
-import string
-from datetime import datetime, UTC
 from typing import Annotated
+from urllib.parse import urlsplit, urlunsplit
 
 from fastapi import Depends, Request, Header, Form
 from fastapi.responses import RedirectResponse
 from pydantic import AnyHttpUrl
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from app import schemas, repositories as repo
 from app.core import exceptions as app_exceptions
-from app.core.config import Environment, settings
-from app.core.db import get_session
+from app.core.bloom_filter import code_filter
+from app.core.cache import url_cache
+from app.core.click_buffer import click_buffer
+from app.core.code_allocator import code_allocator
+from app.core.config import AccessCounterMode, Environment, settings
+from app.core.db import get_session, session_factory
+from app.core.single_flight import code_lookups
 from app.models import UrlColumnSize
 
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21, "ftps": 990}
+
 
 def get_client_ip(
         request: Request,
@@ -64,21 +71,46 @@ def is_valid_url(url: str) -> bool:
         r'(?::\d+)?'  # optional port
         r'(?:/?|[/?]\S+)$', re.IGNORECASE)
 
+    if len(url.encode()) > UrlColumnSize.original_url:
+        return False
+
     return re.match(url_pattern, url) is not None
 
 
-def generate_code(code_length: int = UrlColumnSize.code.value) -> str:
+def normalize_url(url: str) -> str:
     """
-    Generates code for the given code length as maximum length and with minimum length of 4
-    :param code_length: The code length to generate
-    :return: The code generated
+    Normalize the URL so equivalent URLs compare equal, the scheme and host are
+    lower cased, default ports are removed and an empty path becomes "/"
+    :param url: The URL to normalize
+    :return: The normalized URL or the stripped URL if it can not be parsed
     """
-    list_of_base_62_characters = list(string.ascii_letters + string.digits)
-    random.shuffle(list_of_base_62_characters)
-    shuffled_characters = ''.join(list_of_base_62_characters)
-    chars_length = random.randint(4, code_length)
+    url = url.strip()
+
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = parts.hostname or ""
+
+        if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{parts.port}"
+    except ValueError as err:
+        logging.warning(f"Could not normalize url {url}, ex: {err}")
+        return url
+
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
 
-    return ''.join(random.choices(shuffled_characters, k=chars_length))
+def hash_url(url: str) -> bytes:
+    """
+    Hash the normalized URL for deduplication
+    :param url: The URL to hash
+    :return: SHA-256 digest of the normalized URL
+    """
+    return hashlib.sha256(normalize_url(url).encode()).digest()
 
 
 async def create_short_url(
@@ -86,10 +118,11 @@ async def create_short_url(
         db: AsyncSession = Depends(get_session),
 ) -> schemas.UrlInDBBase | schemas.ErrorMessage:
     """
-    Creates a short URL for the given database connection
+    Creates a short URL for the given database connection, or returns the existing
+    short URL if the same URL was already shortened
     :param db: The database connection
     :param url: The URL to create the short URL for
-    :return: The newly created short URL
+    :return: The newly created or existing short URL
     """
     if not is_valid_url(url):
         return schemas.ErrorMessage(
@@ -97,45 +130,207 @@ async def create_short_url(
             error_code=status.HTTP_400_BAD_REQUEST,
         )
 
-    generated_code = generate_code()
-    url_code_db = await repo.UrlShortener(db).get_by_code(generated_code)
+    url_hash = hash_url(url)
 
-    while url_code_db is not None:
-        url_code_db = await repo.UrlShortener(db).get_by_code(generated_code)
+    for _ in range(settings.code_allocation_attempts):
+        url_in = schemas.UrlCreate(
+            original_url=url,
+            original_url_hash=url_hash,
+            code=await code_allocator.allocate(),
+            access_count=0,
+            name=get_sld_from_url(url),
+        )
 
-    url_db = await repo.UrlShortener(db).get_by_url(url)
+        try:
+            url_new = await repo.UrlShortener(db).create_or_get(url_in)
+        except IntegrityError as err:
+            logging.warning(f"Allocated code {url_in.code} already exists, ex: {err}")
+            await db.rollback()
+            continue
 
-    if url_db is not None:
-        return schemas.UrlInDBBase.model_validate(url_db)
+        return schemas.UrlInDBBase.model_validate(url_new)
 
-    url_in = schemas.UrlCreate(
-        original_url=url,
-        code=generated_code,
-        access_count=0,
-        name=get_sld_from_url(url),
-    )
-    url_new = await repo.UrlShortener(db).create(url_in)
+    logging.error(f"Could not allocate a unique code after {settings.code_allocation_attempts} attempts")
 
-    return schemas.UrlInDBBase.model_validate(url_new)
+    raise app_exceptions.InternalServerErrorException("Internal server error")
 
 
-async def get_url(
-        url_code: str,
+async def bulk_create_short_urls(
+        url_bulk_in: schemas.UrlBulkCreate,
         db: AsyncSession = Depends(get_session),
-) -> schemas.UrlInDBBase | schemas.ErrorMessage:
+) -> schemas.UrlBulkCreateResult:
     """
-    Get a URL from the database and return the corresponding schema
+    Creates short URLs for a batch of URLs, existing URLs are looked up in one query and
+    the new ones are inserted with multi-row statements. Invalid URLs are reported per item
+    :param url_bulk_in: The URLs to create the short URLs for
     :param db: The database connection
+    :raise 400 BadRequest: If the batch has more URLs than allowed
+    :return: The short URL or error of every URL, in input order
+    """
+    if len(url_bulk_in.urls) > settings.bulk_create_max_urls:
+        raise app_exceptions.BadRequestException(
+            f"At most {settings.bulk_create_max_urls} URLs can be created at once"
+        )
+
+    items = [schemas.UrlBulkCreateItem(original_url=url) for url in url_bulk_in.urls]
+    items_by_hash: dict[bytes, list[schemas.UrlBulkCreateItem]] = {}
+
+    for item in items:
+        if is_valid_url(item.original_url):
+            items_by_hash.setdefault(hash_url(item.original_url), []).append(item)
+        else:
+            item.error = "Invalid URL"
+
+    # Codes are copied out of the ORM instances, every attempt commits and may expire them
+    url_codes: dict[bytes, str] = {}
+
+    if items_by_hash:
+        for url_db in await repo.UrlShortener(db).get_many_by_url_hash(list(items_by_hash)):
+            url_codes[url_db.original_url_hash] = url_db.code
+
+    new_url_hashes = [url_hash for url_hash in items_by_hash if url_hash not in url_codes]
+
+    # Only the URLs whose code is taken are retried, with new codes
+    for _ in range(settings.code_allocation_attempts):
+        if not new_url_hashes:
+            break
+
+        urls_in = [
+            schemas.UrlCreate(
+                original_url=items_by_hash[url_hash][0].original_url,
+                original_url_hash=url_hash,
+                code=await code_allocator.allocate(),
+                access_count=0,
+                name=get_sld_from_url(items_by_hash[url_hash][0].original_url),
+            )
+            for url_hash in new_url_hashes
+        ]
+        urls_new, urls_conflicted = await repo.UrlShortener(db).bulk_create_or_get(urls_in)
+
+        for url_new in urls_new:
+            url_codes[url_new.original_url_hash] = url_new.code
+
+        if urls_conflicted:
+            logging.warning(f"Allocated codes of {len(urls_conflicted)} URLs for bulk create already exist")
+
+        new_url_hashes = [url_in.original_url_hash for url_in in urls_conflicted]
+    else:
+        if new_url_hashes:
+            logging.error(
+                f"Could not allocate unique codes for {len(new_url_hashes)} URLs "
+                f"after {settings.code_allocation_attempts} attempts"
+            )
+
+    for url_hash, hash_items in items_by_hash.items():
+        url_code = url_codes.get(url_hash)
+
+        for item in hash_items:
+            if url_code is None:
+                item.error = "Could not create short URL"
+            else:
+                item.code = url_code
+                item.shortened_url = settings.server_host + "/" + url_code
+
+    return schemas.UrlBulkCreateResult(urls=items)
+
+
+async def get_url(
+        url_code: str,
+) -> repo.UrlPreview | schemas.ErrorMessage:
+    """
+    Get the URL shown on the preview page of the given code
     :param url_code: The corresponding code for the original URL in the database
     :raise 404 NotFound: If the URL code does not exist
-    :return: The schema for the url in the database
+    :return: The previewed URL
     """
-    url_db = await repo.UrlShortener(db).get_by_code(url_code)
+    if not code_filter.might_exist(url_code):
+        return schemas.ErrorMessage(message="Could not find URL", error_code=status.HTTP_404_NOT_FOUND)
+
+    is_cached, url_cached = await url_cache.get(url_code)
+    url_preview = None
+
+    if not is_cached or url_cached is not None:
+        url_preview = await code_lookups.do(
+            f"url:{url_code}",
+            lambda: load_url_preview(url_code, cache_not_found=not is_cached),
+        )
 
-    if not url_db:
+    if not url_preview:
         return schemas.ErrorMessage(message="Could not find URL", error_code=status.HTTP_404_NOT_FOUND)
 
-    return schemas.UrlInDBBase.model_validate(url_db)
+    return url_preview
+
+
+async def load_url_preview(
+        url_code: str,
+        cache_not_found: bool = True,
+) -> repo.UrlPreview | None:
+    """
+    Load the previewed columns of the URL with the given code from the database.
+    The load is shared by concurrent requests, so it opens its own session instead
+    of using the session of the request that started it
+    :param url_code: The corresponding code for the original URL
+    :param cache_not_found: Cache the code as not found if it does not exist
+    :return: The previewed URL or None if the code does not exist
+    """
+    async with session_factory() as db:
+        url_preview = await repo.UrlShortener(db).get_preview_by_code(url_code)
+
+    if url_preview is None and cache_not_found:
+        await url_cache.set(url_code, None)
+
+    return url_preview
+
+
+async def resolve_url_code(
+        url_code: str,
+) -> schemas.UrlCached | None:
+    """
+    Resolve the given code to its original URL, consulting the cache before the database.
+    Concurrent cache misses for the same code share one database query
+    :param url_code: The corresponding code for the original URL
+    :return: The cached URL or None if the code does not exist
+    """
+    is_cached, url_cached = await url_cache.get(url_code)
+
+    if is_cached:
+        return url_cached
+
+    return await code_lookups.do(f"code:{url_code}", lambda: load_url_code(url_code))
+
+
+async def load_url_code(
+        url_code: str,
+) -> schemas.UrlCached | None:
+    """
+    Load the given code from the database and cache it. When the cross worker lock is
+    enabled and another worker is already loading the code, wait for it to be cached instead.
+    The load is shared by concurrent requests, so it opens its own session instead
+    of using the session of the request that started it
+    :param url_code: The corresponding code for the original URL
+    :return: The cached URL or None if the code does not exist
+    """
+    holds_lock, lock_token = False, None
+
+    if settings.single_flight_lock_enabled:
+        holds_lock, lock_token = await url_cache.acquire_fill_lock(url_code)
+
+    if settings.single_flight_lock_enabled and not holds_lock:
+        is_cached, url_cached = await url_cache.wait_for_fill(url_code)
+
+        if is_cached:
+            return url_cached
+
+    try:
+        async with session_factory() as db:
+            url_cached = await repo.UrlShortener(db).get_redirect_by_code(url_code)
+
+        await url_cache.set(url_code, url_cached)
+    finally:
+        if lock_token is not None:
+            await url_cache.release_fill_lock(url_code, lock_token)
+
+    return url_cached
 
 
 async def redirect_from_code(
@@ -148,19 +343,24 @@ async def redirect_from_code(
     :param db: The database connection
     :return: Redirect to URL or error message schema
     """
-    url_db = await repo.UrlShortener(db).get_by_code(url_code)
+    if not code_filter.might_exist(url_code):
+        url_cached = None
+    elif settings.access_counter_mode is AccessCounterMode.exact:
+        is_cached, url_cached = await url_cache.get(url_code)
 
-    if url_db:
-        url_db.access_count += 1
-        url_db.last_access_date = datetime.now(UTC).replace(tzinfo=None)
-        await repo.UrlShortener(db).update(
-            url_id=url_db.id,
-            url_update_in=schemas.UrlUpdate(
-                **url_db.to_dict(exclude_keys={"id", "creation_date"})
-            ),
-        )
+        if not is_cached or url_cached is not None:
+            url_cached = await repo.UrlShortener(db).register_access(url_code)
+
+            if url_cached is None:
+                await url_cache.set(url_code, None)
+    else:
+        url_cached = await resolve_url_code(url_code)
+
+        if url_cached:
+            click_buffer.record(url_cached.code)
 
-        return RedirectResponse(url_db.original_url)
+    if url_cached:
+        return RedirectResponse(url_cached.original_url)
     else:
         return schemas.ErrorMessage(
             message="The URL with that code does not exist",
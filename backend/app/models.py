@@ -5,8 +5,11 @@ from typing import Any
 
 from sqlalchemy import (
     BigInteger,
+    LargeBinary,
+    Sequence,
     String,
     DateTime,
+    Index,
     Text,
 )
 from sqlalchemy.orm import (
@@ -54,9 +57,23 @@ class Base(DeclarativeBase):
 
 class UrlColumnSize(IntEnum):
     code = 8
+    # Bytes, keeps the URL within the size limit of the covering index on code
+    original_url = 2048
+
+
+# Source of the ids that counter based short codes are encoded from
+url_code_sequence = Sequence("url_code_seq", metadata=meta)
 
 
 class Url(Base):
+    __table_args__ = (
+        # Redirect lookups by code are answered from the index alone
+        Index("ix_url_code_covering", "code", unique=True, postgresql_include=["original_url", "id"]),
+        # Lookups by code only scan the partition the code hashes to, unique
+        # constraints must include code so the primary key is (id, code)
+        {"postgresql_partition_by": "HASH (code)"},
+    )
+
     id: Mapped[int] = mapped_column(
         BigInteger,
         primary_key=True,
@@ -68,13 +85,18 @@ class Url(Base):
     )
     code: Mapped[str] = mapped_column(
         String(),
-        unique=True,
+        primary_key=True,
         nullable=False,
     )
     original_url: Mapped[str] = mapped_column(
         String(),
         nullable=False,
     )
+    # SHA-256 of the normalized original URL, unique through `UrlHash`
+    original_url_hash: Mapped[bytes | None] = mapped_column(
+        LargeBinary(32),
+        nullable=True,
+    )
     description: Mapped[str] = mapped_column(Text(), nullable=True)
     access_count: Mapped[int] = mapped_column(
         BigInteger,
@@ -90,3 +112,22 @@ class Url(Base):
         nullable=False,
         default=datetime.now(UTC).replace(tzinfo=None),
     )
+
+
+class UrlHash(Base):
+    """
+    Original URL hash of every URL and its code.
+
+    A unique index of the partitioned url table has to include code, so the
+    hashes are deduplicated in this unpartitioned table instead.
+    """
+
+    original_url_hash: Mapped[bytes] = mapped_column(
+        LargeBinary(32),
+        primary_key=True,
+    )
+    code: Mapped[str] = mapped_column(
+        String(),
+        nullable=False,
+        unique=True,
+    )
@@ -1,8 +1,55 @@
-from sqlalchemy import select, delete, update
+from collections.abc import AsyncIterator
+from datetime import datetime, UTC
+from typing import Any, Awaitable, Callable, TypeVar
+
+from sqlalchemy import (
+    BigInteger,
+    ColumnElement,
+    DateTime,
+    Select,
+    String,
+    bindparam,
+    column,
+    delete,
+    exc,
+    func,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import schemas
-from app.models import Url
+from app.core.cache import url_cache
+from app.core.db import ReplicaRouter, replica_router
+from app.models import Url, UrlHash
+
+
+# Rows per multi-row INSERT, keeps the bind parameters below the asyncpg limit
+BULK_INSERT_CHUNK_SIZE = 1000
+# URLs per UPDATE ... FROM (VALUES ...), three bind parameters each and at most 32767 per statement
+BULK_UPDATE_CHUNK_SIZE = 5000
+
+T = TypeVar("T")
+
+# Column-only lookups of the hot paths, built once so every call reuses the statement
+# and its cached compilation
+REDIRECT_BY_CODE_STATEMENT = select(Url.id, Url.code, Url.original_url).where(Url.code == bindparam("url_code"))
+PREVIEW_BY_CODE_STATEMENT = select(Url.code, Url.original_url, Url.access_count).where(
+    Url.code == bindparam("url_code")
+)
+
+
+class UrlPreview:
+    """Columns of a URL shown on its preview page, read without an ORM instance."""
+
+    __slots__ = ("code", "original_url", "access_count")
+
+    def __init__(self, code: str, original_url: str, access_count: int) -> None:
+        self.code = code
+        self.original_url = original_url
+        self.access_count = access_count
 
 
 class BaseRepository:
@@ -11,8 +58,44 @@ class BaseRepository:
 
 
 class UrlShortener(BaseRepository):
-    def __init__(self, session: AsyncSession) -> None:
+    def __init__(self, session: AsyncSession, replicas: ReplicaRouter = replica_router) -> None:
         super().__init__(session)
+        self.replicas = replicas
+
+    async def _read(self, read: Callable[[AsyncSession], Awaitable[T]], url_code: str | None = None) -> T:
+        """
+        Run a read on the next healthy replica, or on the primary when there is none
+        or the code was just written. A replica that fails to connect is ejected and
+        the read is retried on the primary. A code a replica does not find is read
+        again on the primary, the replica may lag behind and a miss is cached
+        :param read: The read to run with the session it should use
+        :param url_code: The code the read is for, if any
+        :return: The result of the read
+        """
+        replica = self.replicas.replica_for(url_code)
+
+        if replica is None:
+            return await read(self.session)
+
+        try:
+            async with replica.session_factory() as session:
+                result = await read(session)
+        except (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, OSError) as err:
+            self.replicas.eject(replica, err)
+        else:
+            if result is not None or url_code is None:
+                return result
+
+        return await read(self.session)
+
+    async def _read_scalar(self, statement: Select, url_code: str | None = None) -> Any:
+        return await self._read(lambda session: session.scalar(statement=statement), url_code)
+
+    async def _read_first(self, statement: Select, params: dict, url_code: str | None = None) -> Any:
+        async def read(session: AsyncSession) -> Any:
+            return (await session.execute(statement, params)).first()
+
+        return await self._read(read, url_code)
 
     async def create(self, url_in: schemas.UrlCreate) -> Url:
         url_model = Url(**url_in.model_dump())
@@ -20,16 +103,140 @@ class UrlShortener(BaseRepository):
         self.session.add(url_model)
         await self.session.commit()
         await self.session.refresh(url_model)
+        await url_cache.invalidate(url_model.code)
 
         return url_model
 
+    async def create_or_get(self, url_in: schemas.UrlCreate) -> Url:
+        """
+        Insert the URL, or return the existing URL with the same original URL hash.
+        The hash is claimed in `UrlHash` with INSERT ... ON CONFLICT first, so concurrent
+        requests for the same URL wait for each other and only one of them inserts it
+        :param url_in: The URL to create
+        :raise IntegrityError: If the code of the new URL already exists
+        :return: The created or existing URL
+        """
+        if url_in.original_url_hash is not None:
+            claimed_code = await self.session.scalar(
+                statement=insert(UrlHash).values(
+                    original_url_hash=url_in.original_url_hash,
+                    code=url_in.code,
+                ).on_conflict_do_nothing(
+                    index_elements=[UrlHash.original_url_hash],
+                ).returning(UrlHash.code)
+            )
+
+            if claimed_code is None:
+                url_model = await self.get_by_url_hash(url_in.original_url_hash)
+                await self.session.commit()
+
+                return url_model
+
+        url_model = await self.session.scalar(
+            statement=insert(Url).values(**url_in.model_dump()).returning(Url)
+        )
+        await self.session.commit()
+        await url_cache.invalidate(url_model.code)
+
+        return url_model
+
+    async def bulk_create_or_get(
+            self,
+            urls_in: list[schemas.UrlCreate],
+    ) -> tuple[list[Url], list[schemas.UrlCreate]]:
+        """
+        Insert many URLs with multi-row INSERT ... ON CONFLICT DO NOTHING statements in one
+        transaction, URLs whose original URL hash already exists return the existing row instead.
+        URLs whose code is already taken are skipped and returned, so only they are retried
+        with new codes
+        :param urls_in: The URLs to create, their original URL hashes and codes must be distinct
+        :return: The created or existing URLs, in no particular order, and the URLs whose code is taken
+        """
+        url_models = []
+        urls_conflicted = []
+        created_codes = []
+
+        for chunk_start in range(0, len(urls_in), BULK_INSERT_CHUNK_SIZE):
+            chunk = urls_in[chunk_start:chunk_start + BULK_INSERT_CHUNK_SIZE]
+            url_hashes_in = [
+                {"original_url_hash": url_in.original_url_hash, "code": url_in.code}
+                for url_in in chunk
+                if url_in.original_url_hash is not None
+            ]
+            claimed_hashes = set()
+
+            if url_hashes_in:
+                # A hash is not claimed when it exists or when its code is claimed by another hash
+                statement = insert(UrlHash).values(url_hashes_in).on_conflict_do_nothing().returning(
+                    UrlHash.original_url_hash
+                )
+                claimed_hashes.update(await self.session.scalars(statement=statement))
+
+            unclaimed_hashes = [
+                url_in.original_url_hash for url_in in chunk
+                if url_in.original_url_hash is not None and url_in.original_url_hash not in claimed_hashes
+            ]
+            existing_hashes = set()
+
+            if unclaimed_hashes:
+                for url_model in await self.get_many_by_url_hash(unclaimed_hashes):
+                    url_models.append(url_model)
+                    existing_hashes.add(url_model.original_url_hash)
+
+            urls_new = []
+
+            for url_in in chunk:
+                if url_in.original_url_hash is None or url_in.original_url_hash in claimed_hashes:
+                    urls_new.append(url_in)
+                elif url_in.original_url_hash not in existing_hashes:
+                    urls_conflicted.append(url_in)
+
+            if not urls_new:
+                continue
+
+            statement = insert(Url).values(
+                [url_in.model_dump() for url_in in urls_new]
+            ).on_conflict_do_nothing().returning(Url)
+            urls_created = list(await self.session.scalars(statement=statement))
+            url_models.extend(urls_created)
+            inserted_codes = {url_model.code for url_model in urls_created}
+            created_codes.extend(inserted_codes)
+            lost_claims = []
+
+            for url_in in urls_new:
+                if url_in.code not in inserted_codes:
+                    urls_conflicted.append(url_in)
+
+                    if url_in.original_url_hash is not None:
+                        lost_claims.append(url_in.original_url_hash)
+
+            if lost_claims:
+                # Release the hashes claimed for URLs whose code is taken in url only
+                await self.session.execute(
+                    statement=delete(UrlHash).where(UrlHash.original_url_hash.in_(lost_claims))
+                )
+
+        await self.session.commit()
+        await url_cache.invalidate(*created_codes)
+
+        return url_models, urls_conflicted
+
+    @staticmethod
+    def _by_id(url_id: int, url_code: str | None) -> list[ColumnElement[bool]]:
+        # The code is the partition key, when it is given only its partition is searched for the id
+        if url_code is None:
+            return [Url.id == url_id]
+
+        return [Url.id == url_id, Url.code == url_code]
+
     async def get(
             self,
-            url_id: int
+            url_id: int,
+            url_code: str | None = None,
     ) -> Url | None:
-        statement = select(Url).where(Url.id == url_id)
+        statement = select(Url).where(*self._by_id(url_id, url_code))
 
-        return await self.session.scalar(statement=statement)
+        return await self._read_scalar(statement, url_code=url_code)
 
     async def get_by_code(
             self,
@@ -37,32 +244,196 @@ class UrlShortener(BaseRepository):
     ) -> Url | None:
         statement = select(Url).where(Url.code == url_code)
 
-        return await self.session.scalar(statement=statement)
+        return await self._read_scalar(statement, url_code=url_code)
+
+    async def get_redirect_by_code(
+            self,
+            url_code: str
+    ) -> schemas.UrlCached | None:
+        """
+        Get the columns a redirect needs without loading an ORM instance
+        :param url_code: The code of the URL
+        :return: The URL or None if the code does not exist
+        """
+        url_row = await self._read_first(REDIRECT_BY_CODE_STATEMENT, {"url_code": url_code}, url_code=url_code)
+
+        if url_row is None:
+            return None
+
+        # Columns come straight from the database, so validation is skipped
+        return schemas.UrlCached.model_construct(id=url_row[0], code=url_row[1], original_url=url_row[2])
+
+    async def get_preview_by_code(
+            self,
+            url_code: str
+    ) -> UrlPreview | None:
+        """
+        Get the columns the preview page shows without loading an ORM instance
+        :param url_code: The code of the URL
+        :return: The URL or None if the code does not exist
+        """
+        url_row = await self._read_first(PREVIEW_BY_CODE_STATEMENT, {"url_code": url_code}, url_code=url_code)
+
+        return UrlPreview(*url_row) if url_row is not None else None
 
-    async def get_by_url(
+    async def get_by_url_hash(
             self,
-            url: str
+            url_hash: bytes
     ) -> Url | None:
-        statement = select(Url).where(Url.original_url == url)
+        # The code is looked up first, so only its partition is scanned
+        statement = select(Url).where(
+            Url.code == select(UrlHash.code).where(UrlHash.original_url_hash == url_hash).scalar_subquery()
+        )
 
         return await self.session.scalar(statement=statement)
 
+    async def get_many_by_url_hash(
+            self,
+            url_hashes: list[bytes]
+    ) -> list[Url]:
+        statement = select(Url).join(UrlHash, UrlHash.code == Url.code).where(
+            UrlHash.original_url_hash.in_(url_hashes)
+        )
+
+        return list(await self.session.scalars(statement=statement))
+
+    async def get_most_accessed_codes(
+            self,
+            limit: int,
+            accessed_since: datetime,
+    ) -> list[str]:
+        """
+        Get the codes of the most accessed URLs that were accessed since the given date.
+        There is no index on the access count, it changes with every click flush, so
+        this sorts the table and should be run once and shared
+        :param limit: Maximum number of codes to return
+        :param accessed_since: Only URLs accessed after this date are returned
+        :return: The codes, most accessed first
+        """
+        statement = select(Url.code).where(
+            Url.last_access_date >= accessed_since
+        ).order_by(Url.access_count.desc()).limit(limit)
+
+        return list(await self.session.scalars(statement=statement))
+
+    async def stream_redirects_by_code(
+            self,
+            url_codes: list[str],
+            chunk_size: int = BULK_INSERT_CHUNK_SIZE,
+    ) -> AsyncIterator[schemas.UrlCached]:
+        """
+        Stream the columns a redirect needs for the given codes, each chunk of codes
+        is read through the covering index on code
+        :param url_codes: The codes to read
+        :param chunk_size: Number of codes per query
+        :return: Iterator of the URLs that exist, in the order of the chunks
+        """
+        for chunk_start in range(0, len(url_codes), chunk_size):
+            statement = select(Url.id, Url.code, Url.original_url).where(
+                Url.code.in_(url_codes[chunk_start:chunk_start + chunk_size])
+            )
+
+            for url_row in await self.session.execute(statement=statement):
+                yield schemas.UrlCached.model_validate(url_row)
+
     async def update(
             self,
             url_id: int,
-            url_update_in: schemas.UrlUpdate
+            url_update_in: schemas.UrlUpdate,
+            url_code: str | None = None,
     ) -> Url | None:
-        url_model = await self.get(url_id=url_id)
-        statement = update(Url).where(Url.id == url_id).values(
+        # Read on the primary, replicas may not have the latest code yet
+        url_model = await self.session.scalar(select(Url).where(*self._by_id(url_id, url_code)))
+        statement = update(Url).where(*self._by_id(url_id, url_code)).values(
             **url_update_in.model_dump(exclude_none=True)
         )
         await self.session.execute(statement=statement)
+
+        if url_model is not None and url_update_in.code and url_model.original_url_hash is not None:
+            await self.session.execute(
+                statement=update(UrlHash).where(
+                    UrlHash.original_url_hash == url_model.original_url_hash
+                ).values(code=url_update_in.code)
+            )
+
         await self.session.commit()
 
+        if url_model is not None:
+            await url_cache.invalidate(
+                *{url_model.code, url_update_in.code or url_model.code}
+            )
+
         return url_model
 
-    async def delete(self, url_id: int) -> int:
-        await self.session.execute(delete(Url).where(Url.id == url_id))
+    async def register_access(
+            self,
+            url_code: str,
+    ) -> schemas.UrlCached | None:
+        """
+        Increment the access count of the URL with the given code and return it,
+        in a single UPDATE ... RETURNING statement
+        :param url_code: The code of the accessed URL
+        :return: The accessed URL or None if the code does not exist
+        """
+        statement = update(Url).where(Url.code == url_code).values(
+            access_count=Url.access_count + 1,
+            last_access_date=datetime.now(UTC).replace(tzinfo=None),
+        ).returning(Url.id, Url.code, Url.original_url)
+        url_row = (await self.session.execute(statement=statement)).first()
+        await self.session.commit()
+
+        return schemas.UrlCached.model_validate(url_row) if url_row else None
+
+    async def bulk_increment_access_count(
+            self,
+            url_accesses: dict[str, tuple[int, datetime]],
+    ) -> None:
+        """
+        Add access counts to many URLs with UPDATE ... FROM (VALUES ...) statements
+        in one transaction. The rows are matched on code, the partition key, so each
+        one is looked up in its own partition only
+        :param url_accesses: Mapping of URL code to the clicks to add and the latest access date
+        :return: None
+        """
+        if not url_accesses:
+            return
+
+        # Sorted so concurrent flushes lock rows in the same order
+        url_clicks = [
+            (url_code, count, last_access_date)
+            for url_code, (count, last_access_date) in sorted(url_accesses.items())
+        ]
+
+        for chunk_start in range(0, len(url_clicks), BULK_UPDATE_CHUNK_SIZE):
+            clicks = values(
+                column("code", String),
+                column("clicks", BigInteger),
+                column("last_access_date", DateTime),
+                name="clicks",
+            ).data(url_clicks[chunk_start:chunk_start + BULK_UPDATE_CHUNK_SIZE])
+            statement = update(Url).where(Url.code == clicks.c.code).values(
+                access_count=Url.access_count + clicks.c.clicks,
+                last_access_date=func.greatest(Url.last_access_date, clicks.c.last_access_date),
+            )
+            await self.session.execute(statement=statement)
+
         await self.session.commit()
 
+    async def delete(self, url_id: int, url_code: str | None = None) -> int:
+        url_row = (
+            await self.session.execute(
+                statement=delete(Url).where(*self._by_id(url_id, url_code)).returning(Url.original_url_hash, Url.code)
+            )
+        ).first()
+
+        if url_row is not None and url_row.original_url_hash is not None:
+            await self.session.execute(
+                statement=delete(UrlHash).where(UrlHash.original_url_hash == url_row.original_url_hash)
+            )
+
+        await self.session.commit()
+
+        if url_row is not None:
+            await url_cache.invalidate(url_row.code)
+
         return url_id
@@ -1,11 +1,18 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import HTMLResponse
 
+from app import repositories as repo
 from app import schemas
-from app.core.config import settings
+from app.core.bloom_filter import code_filter
+from app.core.cache import url_cache
+from app.core.click_buffer import click_buffer
+from app.core.config import RateLimitStrategy, settings
+from app.core.db import engine
+from app.core.single_flight import code_lookups
 from app.core.middleware.rate_limiter import RateLimitMinuteMiddleware
+from app.core.redis import redis_breaker
 from app.core.utils import templates
-from app.deps import create_short_url, redirect_from_code, get_url
+from app.deps import bulk_create_short_urls, create_short_url, redirect_from_code, get_url
 
 router = APIRouter()
 
@@ -41,6 +48,22 @@ def create_url(
     )
 
 
+@router.post(
+    path=f"{settings.api_v1_str}/urls/bulk",
+    dependencies=[
+        Depends(
+            RateLimitMinuteMiddleware(
+                request_per_minute=schemas.UrlAPILimit.bulk_create_urls.value
+            )
+        )
+    ]
+)
+def bulk_create_urls(
+        result: schemas.UrlBulkCreateResult = Depends(bulk_create_short_urls),
+) -> schemas.UrlBulkCreateResult:
+    return result
+
+
 @router.get(
     path="/",
     response_class=HTMLResponse,
@@ -56,13 +79,50 @@ def get_url_using_code(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@router.get(path=f"{settings.api_v1_str}/metrics/cache")
+def get_cache_metrics() -> schemas.LocalCacheStats:
+    """Counters of the local cache for the worker that served the request."""
+    return url_cache.local.stats()
+
+
+@router.get(path=f"{settings.api_v1_str}/metrics/click-buffer")
+def get_click_buffer_metrics() -> schemas.ClickBufferStats:
+    """Pending and dropped clicks of the access count buffer for the worker that served the request."""
+    return click_buffer.stats()
+
+
+@router.get(path=f"{settings.api_v1_str}/metrics/code-filter")
+def get_code_filter_metrics() -> schemas.CodeFilterStats:
+    """Size and false positive rate of the code filter for the worker that served the request."""
+    return code_filter.stats()
+
+
+@router.get(path=f"{settings.api_v1_str}/metrics/single-flight")
+def get_single_flight_metrics() -> schemas.SingleFlightStats:
+    """Coalesced code lookups for the worker that served the request."""
+    return code_lookups.stats()
+
+
+@router.get(path=f"{settings.api_v1_str}/metrics/db-pool")
+def get_db_pool_metrics() -> schemas.DbPoolStats:
+    """Occupancy and checkout wait time of the database pool for the worker that served the request."""
+    return engine.pool.stats()
+
+
+@router.get(path=f"{settings.api_v1_str}/metrics/rate-limiter")
+def get_rate_limiter_metrics() -> schemas.CircuitBreakerStats:
+    """State of the Redis circuit breaker of the rate limiter and the cache for the worker that served the request."""
+    return redis_breaker.stats()
+
+
 @router.get(
     path="/{url_code}",
     response_class=HTMLResponse,
     dependencies=[
         Depends(
             RateLimitMinuteMiddleware(
-                request_per_minute=schemas.UrlAPILimit.redirect_to_url_using_code.value
+                request_per_minute=schemas.UrlAPILimit.redirect_to_url_using_code.value,
+                strategy=RateLimitStrategy.local_token_bucket,
             )
         )
     ]
@@ -93,7 +153,7 @@ def redirect_to_url_using_code(
 )
 def preview_url_using_code(
         request: Request,
-        url_db: schemas.UrlInDBBase | schemas.ErrorMessage = Depends(get_url)
+        url_db: repo.UrlPreview | schemas.ErrorMessage = Depends(get_url)
 ):
     if type(url_db) is schemas.ErrorMessage:
         return templates.TemplateResponse(
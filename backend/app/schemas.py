@@ -29,6 +29,7 @@ class UrlCreate(UrlBase):
     name: str | None = None
     description: str | None = None
     access_count: int
+    original_url_hash: bytes | None = None
 
 
 class UrlUpdate(UrlBase):
@@ -44,6 +45,82 @@ class UrlDelete(UrlBase):
     pass
 
 
+class UrlCached(BaseModelSchema):
+    id: int
+    code: str
+    original_url: str
+
+
+class UrlBulkCreate(BaseModelSchema):
+    urls: list[str]
+
+
+class UrlBulkCreateItem(BaseModelSchema):
+    original_url: str
+    code: str | None = None
+    shortened_url: str | None = None
+    error: str | None = None
+
+
+class UrlBulkCreateResult(BaseModelSchema):
+    urls: list[UrlBulkCreateItem]
+
+
+class LocalCacheStats(BaseModelSchema):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class SingleFlightStats(BaseModelSchema):
+    in_flight: int
+    calls: int
+    coalesced: int
+
+
+class ClickBufferStats(BaseModelSchema):
+    pending: int
+    max_pending: int
+    max_retained: int
+    # Consecutive failed flushes, 0 after a successful one
+    failed_flushes: int
+    dropped_clicks: int
+
+
+class CodeFilterStats(BaseModelSchema):
+    enabled: bool
+    ready: bool
+    capacity: int
+    items: int
+    size_bytes: int
+    hash_count: int
+    configured_false_positive_rate: float
+    estimated_false_positive_rate: float
+    rejected: int
+
+
+class DbPoolStats(BaseModelSchema):
+    size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    max_overflow: int
+    checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+
+
+class CircuitBreakerStats(BaseModelSchema):
+    state: str
+    consecutive_failures: int
+    fallback_hits: int
+    # Number of times each "from->to" state transition happened
+    transitions: dict[str, int]
+
+
 class ErrorMessage(BaseModelSchema):
     message: str
     error_code: int
@@ -52,6 +129,7 @@ class ErrorMessage(BaseModelSchema):
 
 class UrlAPILimit(IntEnum):
     create_url = 40
+    bulk_create_urls = 10
     get_url_using_code = 60
     redirect_to_url_using_code = 60
     preview_url_using_code = 30
@@ -7,10 +7,11 @@ from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from starlette import status
 
-from app.core.config import settings, Environment
+from app.core.config import AccessCounterMode, settings, Environment
 from app.core.logger import configure_logging
 from app.core.utils import templates
 from app.routers import router
+from app.web.fast_redirect import FastRedirectMiddleware
 from app.web.lifetime import register_startup_event, register_shutdown_event
 
 
@@ -46,6 +47,9 @@ def get_app() -> FastAPI:
     register_startup_event(app)
     register_shutdown_event(app)
 
+    if settings.fast_redirect_enabled and settings.access_counter_mode is AccessCounterMode.batched:
+        app.add_middleware(FastRedirectMiddleware)
+
     app.add_middleware(
         CORSMiddleware,
         allow_origins=settings.cors_origins,
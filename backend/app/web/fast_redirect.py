@@ -0,0 +1,82 @@
+import logging
+import re
+from functools import lru_cache
+from urllib.parse import quote
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.cache import UrlCache, url_cache
+from app.core.click_buffer import ClickBuffer, click_buffer
+from app.models import UrlColumnSize
+
+CODE_PATH_PATTERN = re.compile(rf"/([0-9A-Za-z]{{1,{UrlColumnSize.code.value}}})")
+
+# Same safe characters as starlette's RedirectResponse
+LOCATION_SAFE_CHARACTERS = ":/%#?=@[]!$&'()*+,;"
+
+REDIRECT_RESPONSE_START = {
+    "type": "http.response.start",
+    "status": 307,
+}
+REDIRECT_RESPONSE_BODY = {
+    "type": "http.response.body",
+    "body": b"",
+}
+
+
+@lru_cache(maxsize=10_000)
+def redirect_headers_for(original_url: str) -> list[tuple[bytes, bytes]]:
+    """
+    Build the raw headers of a redirect to the given URL
+    :param original_url: The URL to redirect to
+    :return: The encoded response headers
+    """
+    return [
+        (b"content-length", b"0"),
+        (b"location", quote(original_url, safe=LOCATION_SAFE_CHARACTERS).encode("latin-1")),
+    ]
+
+
+class FastRedirectMiddleware:
+    """
+    Lean ASGI handler for redirects of cached codes.
+
+    `GET /{url_code}` requests whose code is in the cache are answered here,
+    skipping routing, dependency resolution and the rate limiter. The click is
+    recorded in the write-behind buffer, so this only works with the batched
+    access counter mode. Anything else, including cache misses, unknown codes
+    and errors, falls through to the full application.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            cache: UrlCache = url_cache,
+            clicks: ClickBuffer = click_buffer,
+    ) -> None:
+        self.app = app
+        self.cache = cache
+        self.clicks = clicks
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        match = CODE_PATH_PATTERN.fullmatch(scope["path"])
+
+        if match is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            _, url_cached = await self.cache.get(match.group(1))
+            headers = redirect_headers_for(url_cached.original_url) if url_cached else None
+        except Exception as ex:
+            logging.error(f"Fast redirect failed for {scope['path']}, ex: {ex}")
+            return await self.app(scope, receive, send)
+
+        if headers is None:
+            return await self.app(scope, receive, send)
+
+        self.clicks.record(url_cached.code)
+        await send({**REDIRECT_RESPONSE_START, "headers": headers})
+        await send(REDIRECT_RESPONSE_BODY)
@@ -1,28 +1,133 @@
+import asyncio
+import contextlib
+import logging
+from datetime import datetime, timedelta, UTC
 from typing import Awaitable, Callable
 
 from fastapi import FastAPI
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from app.core.db import engine
+from app import repositories as repo
+
+from app.core.bloom_filter import code_filter
+from app.core.cache import url_cache
+from app.core.click_buffer import click_buffer
+from app.core.code_allocator import code_allocator
+from app.core.config import settings
+from app.core.db import engine, replica_router, session_factory
+from app.core.logger import log_writer
+from app.core.middleware.rate_limiter import local_token_buckets
+from app.core.redis import redis_client, redis_pubsub_client
 
 
 def _setup_db(app: FastAPI) -> None:
     """
-    Creates connection to the database.
+    Stores the database engine in the application's state property.
 
-    This function creates SQLAlchemy engine instance,
-    session_factory for creating sessions
-    and stores them in the application's state property.
+    Sessions are created from the application scoped factory in `app.core.db`.
+    Read replicas follow cache invalidations to keep reads of new codes on the primary.
+    It also starts building the filter of existing codes in the background.
 
     :param app: fastAPI application.
     """
 
-    session_factory = async_sessionmaker(
-        engine,
-        expire_on_commit=False,
-    )
     app.state.db_engine = engine  # noqa
-    app.state.db_session_factory = session_factory  # noqa
+    app.state.code_filter_task = None  # noqa
+
+    if replica_router.enabled:
+        url_cache.listeners.append(replica_router)
+
+    if code_filter.enabled:
+        url_cache.listeners.append(code_filter)
+        app.state.code_filter_task = asyncio.create_task(  # noqa
+            code_filter.run(session_factory)
+        )
+
+
+async def _warm_up_cache(session_factory: async_sessionmaker[AsyncSession]) -> None:
+    """
+    Preloads the most accessed codes into the worker's warm map.
+
+    The most accessed codes are sorted by the first worker and
+    shared with the others through Redis, every worker then reads
+    the rows of those codes by their index. The preload stops with
+    what it has once the time budget is spent. Codes invalidated
+    while the rows stream are skipped, their rows may have been
+    read before the invalidation.
+
+    :param session_factory: factory used to open the database session.
+    """
+
+    accessed_since = datetime.now(UTC).replace(tzinfo=None) - timedelta(days=settings.cache_warmup_recent_days)
+    loaded = 0
+    url_cache.start_warm_up()
+
+    try:
+        async with asyncio.timeout(settings.cache_warmup_time_budget_seconds):
+            async with session_factory() as session:
+                url_repo = repo.UrlShortener(session)
+                url_codes = await url_cache.shared_warm_up_codes(
+                    lambda: url_repo.get_most_accessed_codes(settings.cache_warmup_size, accessed_since)
+                )
+
+                async for url_cached in url_repo.stream_redirects_by_code(url_codes):
+                    if url_cache.warm_up(url_cached):
+                        loaded += 1
+    except TimeoutError:
+        logging.warning(f"Cache warm up ran out of time after loading {loaded} codes")
+    except Exception as ex:
+        logging.error(f"Could not warm up the cache, ex: {ex}")
+    else:
+        logging.info(f"Cache warm up loaded {loaded} codes")
+    finally:
+        url_cache.finish_warm_up()
+
+
+def _setup_cache(app: FastAPI) -> None:
+    """
+    Starts listening for cache invalidations from other workers
+    and preloading the most accessed codes.
+
+    Both run in the background so they never delay the worker
+    accepting connections. The tasks are stored in the application's
+    state so they can be cancelled on shutdown.
+
+    :param app: fastAPI application.
+    """
+
+    app.state.cache_invalidation_task = asyncio.create_task(  # noqa
+        url_cache.listen_for_invalidations()
+    )
+    app.state.cache_warmup_task = None  # noqa
+
+    if settings.cache_warmup_size > 0:
+        app.state.cache_warmup_task = asyncio.create_task(  # noqa
+            _warm_up_cache(session_factory)
+        )
+
+
+def _setup_click_buffer(app: FastAPI) -> None:
+    """
+    Starts flushing buffered access counts in the background.
+
+    :param app: fastAPI application.
+    """
+
+    app.state.click_buffer_task = asyncio.create_task(  # noqa
+        click_buffer.run(session_factory)
+    )
+
+
+def _setup_rate_limiter(app: FastAPI) -> None:
+    """
+    Starts reconciling the local token buckets with Redis in the background.
+
+    :param app: fastAPI application.
+    """
+
+    app.state.rate_limit_sync_task = asyncio.create_task(  # noqa
+        local_token_buckets.run()
+    )
 
 
 def register_startup_event(
@@ -42,6 +147,10 @@ def register_startup_event(
     async def _startup() -> None:
         app.middleware_stack = None
         _setup_db(app)
+        _setup_cache(app)
+        _setup_click_buffer(app)
+        _setup_rate_limiter(app)
+        code_allocator.prefetch()
         app.middleware_stack = app.build_middleware_stack()
         pass
 
@@ -60,7 +169,24 @@ def register_shutdown_event(
 
     @app.on_event("shutdown")
     async def _shutdown() -> None:  # noqa: WPS430
+        app.state.cache_invalidation_task.cancel()  # noqa
+
+        if app.state.cache_warmup_task is not None:  # noqa
+            app.state.cache_warmup_task.cancel()  # noqa
+
+        if app.state.code_filter_task is not None:  # noqa
+            app.state.code_filter_task.cancel()  # noqa
+
+        app.state.rate_limit_sync_task.cancel()  # noqa
+        app.state.click_buffer_task.cancel()  # noqa
+        with contextlib.suppress(asyncio.CancelledError):
+            await app.state.click_buffer_task  # noqa
+        await click_buffer.flush(session_factory)
         await app.state.db_engine.dispose()  # noqa
+        await replica_router.dispose()
+        await redis_client.aclose()
+        await redis_pubsub_client.aclose()
+        await asyncio.to_thread(log_writer.stop)
         pass
 
     return _shutdown
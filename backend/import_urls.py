@@ -0,0 +1,369 @@
+"""
+Import URLs from a CSV or NDJSON file into the url table.
+
+Every line holds one URL, CSV files need a header with a `url` column
+and NDJSON lines are objects with a `url` key. Both can carry an optional
+`code`, otherwise a code is allocated the same way as the web application.
+
+The file is streamed in chunks, each chunk is copied into a temporary table
+with COPY. The URL hashes are claimed in the url_hash table and the URLs that
+got their claim are moved to the url table, both with INSERT ... ON CONFLICT
+DO NOTHING. URLs that already exist are counted as duplicates and skipped.
+URLs whose code is taken are counted as code conflicts, allocated codes are
+replaced and retried, and records that brought their own code are written to
+the reject file with the reason. Lines that can not be parsed and records with
+an invalid URL or code are counted as invalid and written to the reject file
+as well, with the line's byte offset. Imported codes are invalidated in the cache
+so running workers pick them up. The byte offset after every committed chunk
+is saved to a checkpoint file, running the same command again resumes from there.
+
+Usage:
+    python import_urls.py links.csv --chunk-size 10000 --rejects links.rejected.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from collections.abc import Iterator
+from datetime import datetime, UTC
+from pathlib import Path
+
+import asyncpg
+
+from app.core.cache import url_cache
+from app.core.code_allocator import code_allocator
+from app.core.config import settings
+from app.deps import get_sld_from_url, hash_url, is_valid_url
+
+IMPORT_COLUMNS = (
+    "name",
+    "code",
+    "original_url",
+    "original_url_hash",
+    "access_count",
+    "last_access_date",
+    "creation_date",
+)
+
+
+def read_checkpoint(checkpoint_path: Path) -> dict:
+    checkpoint = {
+        "offset": 0,
+        "read": 0,
+        "inserted": 0,
+        "duplicates": 0,
+        "code_conflicts": 0,
+        "rejected": 0,
+        "invalid": 0,
+    }
+
+    if checkpoint_path.exists():
+        checkpoint.update(json.loads(checkpoint_path.read_text()))
+
+    return checkpoint
+
+
+def write_rejects(rejects_path: Path, rejects: list[dict]) -> None:
+    if not rejects:
+        return
+
+    with open(rejects_path, "a") as f:
+        for reject in rejects:
+            f.write(json.dumps(reject) + "\n")
+
+
+def write_checkpoint(checkpoint_path: Path, checkpoint: dict) -> None:
+    temporary_path = checkpoint_path.with_suffix(checkpoint_path.suffix + ".tmp")
+    temporary_path.write_text(json.dumps(checkpoint))
+    os.replace(temporary_path, checkpoint_path)
+
+
+def parse_line(line: bytes, header: list[str] | None) -> dict:
+    """
+    Parse one line of the input file
+    :param line: The line, without surrounding whitespace
+    :param header: The CSV header, None for NDJSON
+    :raise ValueError: If the line is not valid UTF-8, CSV or a JSON object
+    :return: The record
+    """
+    text = line.decode()
+
+    if header is not None:
+        return dict(zip(header, next(csv.reader([text]))))
+
+    record = json.loads(text)
+
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a JSON object, got {type(record).__name__}")
+
+    return record
+
+
+def read_records(
+        input_path: Path,
+        input_format: str,
+        offset: int,
+        chunk_size: int,
+) -> Iterator[tuple[list[dict], list[dict], int]]:
+    """
+    Stream the records of the input file in chunks, lines that can not be parsed
+    are returned as rejects instead of stopping the import
+    :param input_path: The file to read
+    :param input_format: Either csv or ndjson
+    :param offset: Byte offset to start reading from, 0 reads from the beginning
+    :param chunk_size: Number of lines per chunk
+    :return: Iterator of chunks, the rejects of their malformed lines and the byte offset after each chunk
+    """
+    with open(input_path, "rb") as f:
+        header = None
+
+        if input_format == "csv":
+            header_line = f.readline()
+            header = next(csv.reader([header_line.decode()]))
+            offset = max(offset, len(header_line))
+
+        f.seek(offset)
+        chunk = []
+        malformed = []
+
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                chunk.append(parse_line(line, header))
+            except (ValueError, csv.Error) as err:
+                # UnicodeDecodeError and JSONDecodeError are ValueErrors
+                malformed.append({
+                    "offset": line_offset,
+                    "line": line.decode(errors="backslashreplace"),
+                    "reason": f"malformed line: {err}",
+                })
+
+            if len(chunk) + len(malformed) >= chunk_size:
+                yield chunk, malformed, offset
+                chunk = []
+                malformed = []
+
+        if chunk or malformed:
+            yield chunk, malformed, offset
+
+
+async def prepare_rows(records: list[dict]) -> tuple[list[tuple], list[bool], list[dict]]:
+    """
+    Validate the records and build the rows to copy
+    :param records: The records read from the input file
+    :return: The rows to copy, whether each row brought its own code and the rejects of the invalid records
+    """
+    rows = []
+    own_codes = []
+    invalid = []
+    now = datetime.now(UTC).replace(tzinfo=None)
+
+    for record in records:
+        url = record.get("url")
+        code = record.get("code") or ""
+
+        if not isinstance(url, str) or not is_valid_url(url.strip()):
+            invalid.append({"url": url, "code": code, "reason": "invalid URL"})
+            continue
+
+        url = url.strip()
+        code = code.strip() if isinstance(code, str) else code
+
+        if not isinstance(code, str) or (code and not (code.isascii() and code.isalnum())):
+            invalid.append({"url": url, "code": code, "reason": "invalid code"})
+            continue
+
+        own_codes.append(bool(code))
+        code = code or await code_allocator.allocate()
+        rows.append((get_sld_from_url(url), code, url, hash_url(url), 0, now, now))
+
+    return rows, own_codes, invalid
+
+
+async def insert_rows(
+        connection: asyncpg.Connection,
+        table: str,
+        hash_table: str,
+        rows: list[tuple],
+) -> tuple[set[tuple[bytes, str]], set[bytes]]:
+    """
+    Insert the rows whose URL hash and code are both free, within the current transaction
+    :param connection: The database connection
+    :param table: The url table
+    :param hash_table: The url_hash table
+    :param rows: The rows to insert
+    :return: The hash and code of every inserted row and the hashes of the URLs that already exist
+    """
+    columns = ", ".join(IMPORT_COLUMNS)
+    await connection.execute("DELETE FROM url_import")
+    await connection.copy_records_to_table("url_import", records=rows, columns=IMPORT_COLUMNS)
+    # Codes of old URLs without a hash are not in url_hash, they are checked in url
+    claimed = await connection.fetch(
+        f"""
+        INSERT INTO {hash_table} (original_url_hash, code)
+        SELECT original_url_hash, code FROM url_import
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.code = url_import.code)
+        ON CONFLICT DO NOTHING
+        RETURNING original_url_hash, code
+        """
+    )
+    inserted = {
+        (url_row["original_url_hash"], url_row["code"])
+        for url_row in await connection.fetch(
+            f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM url_import
+            JOIN unnest($1::bytea[], $2::varchar[]) AS claimed(original_url_hash, code)
+                USING (original_url_hash, code)
+            ON CONFLICT DO NOTHING
+            RETURNING original_url_hash, code
+            """,
+            [claim["original_url_hash"] for claim in claimed],
+            [claim["code"] for claim in claimed],
+        )
+    }
+    # A claimed code can still be taken in url by a concurrent insert, its claim is given back
+    lost_claims = [
+        claim["original_url_hash"] for claim in claimed
+        if (claim["original_url_hash"], claim["code"]) not in inserted
+    ]
+
+    if lost_claims:
+        await connection.execute(
+            f"DELETE FROM {hash_table} WHERE original_url_hash = ANY($1::bytea[])",
+            lost_claims,
+        )
+
+    existing = await connection.fetch(
+        f"SELECT original_url_hash FROM {hash_table} WHERE original_url_hash = ANY($1::bytea[])",
+        [row[IMPORT_COLUMNS.index("original_url_hash")] for row in rows],
+    )
+
+    return inserted, {url_row["original_url_hash"] for url_row in existing}
+
+
+async def import_urls(
+        input_path: Path,
+        input_format: str,
+        checkpoint_path: Path,
+        rejects_path: Path,
+        chunk_size: int,
+) -> None:
+    checkpoint = read_checkpoint(checkpoint_path)
+    code_index = IMPORT_COLUMNS.index("code")
+    url_index = IMPORT_COLUMNS.index("original_url")
+    hash_index = IMPORT_COLUMNS.index("original_url_hash")
+    table = f'"{settings.db_schema}".url'
+    hash_table = f'"{settings.db_schema}".url_hash'
+    connection = await asyncpg.connect(
+        host=settings.db_host,
+        port=settings.db_port,
+        user=settings.db_user,
+        password=settings.db_pass,
+        database=settings.db_base,
+    )
+
+    try:
+        await connection.execute(
+            f"""
+            CREATE TEMPORARY TABLE url_import
+            ON COMMIT DELETE ROWS
+            AS SELECT {", ".join(IMPORT_COLUMNS)} FROM {table} WITH NO DATA
+            """
+        )
+        start = time.perf_counter()
+        read_at_start = checkpoint["read"]
+
+        if checkpoint["offset"]:
+            print(f"Resuming from byte {checkpoint['offset']} after {checkpoint['read']} records")
+
+        for records, malformed, offset in read_records(input_path, input_format, checkpoint["offset"], chunk_size):
+            rows, own_codes, invalid = await prepare_rows(records)
+            invalid = malformed + invalid
+            inserted_codes = []
+            duplicates = 0
+            code_conflicts = 0
+            rejects = []
+
+            async with connection.transaction():
+                for _ in range(settings.code_allocation_attempts):
+                    if not rows:
+                        break
+
+                    inserted, existing = await insert_rows(connection, table, hash_table, rows)
+                    retry_rows = []
+
+                    for row, own_code in zip(rows, own_codes):
+                        if (row[hash_index], row[code_index]) in inserted:
+                            inserted_codes.append(row[code_index])
+                        elif row[hash_index] in existing:
+                            duplicates += 1
+                        elif own_code:
+                            code_conflicts += 1
+                            rejects.append({"url": row[url_index], "code": row[code_index], "reason": "code is taken"})
+                        else:
+                            code_conflicts += 1
+                            retry_rows.append(
+                                row[:code_index] + (await code_allocator.allocate(),) + row[code_index + 1:]
+                            )
+
+                    rows, own_codes = retry_rows, [False] * len(retry_rows)
+
+                # Rows left after the last attempt could not get a free code
+                rejects.extend(
+                    {"url": row[url_index], "code": None, "reason": "no free code"}
+                    for row in rows
+                )
+
+            write_rejects(rejects_path, invalid + rejects)
+            await url_cache.invalidate(*inserted_codes)
+            checkpoint["offset"] = offset
+            checkpoint["read"] += len(records) + len(malformed)
+            checkpoint["inserted"] += len(inserted_codes)
+            checkpoint["duplicates"] += duplicates
+            checkpoint["code_conflicts"] += code_conflicts
+            checkpoint["rejected"] += len(rejects)
+            checkpoint["invalid"] += len(invalid)
+            write_checkpoint(checkpoint_path, checkpoint)
+
+            rate = (checkpoint["read"] - read_at_start) / (time.perf_counter() - start)
+            print(
+                f"read={checkpoint['read']} inserted={checkpoint['inserted']} "
+                f"duplicates={checkpoint['duplicates']} code_conflicts={checkpoint['code_conflicts']} "
+                f"rejected={checkpoint['rejected']} invalid={checkpoint['invalid']} "
+                f"rate={rate:,.0f} records/sec"
+            )
+    finally:
+        await connection.close()
+
+    print(f"Import of {input_path} finished")
+
+
+def main() -> None:
+    """Entrypoint of the URL importer."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="CSV or NDJSON file to import")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="records per COPY")
+    parser.add_argument("--checkpoint", type=Path, help="defaults to <input>.checkpoint")
+    parser.add_argument("--rejects", type=Path, help="NDJSON file of rejected records, defaults to <input>.rejected")
+    args = parser.parse_args()
+
+    input_format = args.format or ("csv" if args.input.suffix.lower() == ".csv" else "ndjson")
+    checkpoint_path = args.checkpoint or args.input.with_name(args.input.name + ".checkpoint")
+    rejects_path = args.rejects or args.input.with_name(args.input.name + ".rejected")
+
+    asyncio.run(import_urls(args.input, input_format, checkpoint_path, rejects_path, args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
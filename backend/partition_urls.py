@@ -0,0 +1,142 @@
+"""
+Copy the rows of the url table into the partitioned url table.
+
+Runs between the two migrations that partition the url table: after
+`add partitioned url table`, which creates url_partitioned and a trigger
+mirroring new writes to it, and before `swap url for partitioned url`.
+
+Rows are copied in ranges of ids, every batch in its own short transaction
+that also saves the progress, so the copy can be stopped and running it again
+resumes after the last committed batch. The copied rows are locked with
+FOR KEY SHARE until their batch commits, which only waits for deletes and
+code changes of those rows, access count updates keep going. Sleep between
+batches to leave room for the application on a busy database.
+
+Usage:
+    python partition_urls.py --batch-size 10000 --sleep 0.1
+"""
+import argparse
+import asyncio
+import time
+
+import asyncpg
+
+from app.core.config import settings
+
+URL_COLUMNS = (
+    "id",
+    "name",
+    "code",
+    "original_url",
+    "original_url_hash",
+    "description",
+    "access_count",
+    "last_access_date",
+    "creation_date",
+)
+
+
+async def copy_batch(connection: asyncpg.Connection, schema: str, batch_size: int) -> tuple[int, int, int, bool]:
+    """
+    Copy the next range of ids and save the progress in the same transaction
+    :param connection: The database connection
+    :param schema: Schema of the url tables
+    :param batch_size: Number of ids per batch
+    :return: The number of copied rows, the last copied id, the last id to copy
+    and whether the copy is complete
+    """
+    columns = ", ".join(URL_COLUMNS)
+
+    async with connection.transaction():
+        progress = await connection.fetchrow(
+            f'SELECT last_id, max_id, completed_at FROM "{schema}".url_partition_backfill WHERE id = 1 FOR UPDATE'
+        )
+
+        if progress is None:
+            raise SystemExit("The url_partition_backfill table is empty, run the migrations first")
+
+        if progress["completed_at"] is not None:
+            return 0, progress["last_id"], progress["max_id"], True
+
+        last_id = min(progress["last_id"] + batch_size, progress["max_id"])
+        status = await connection.execute(
+            f"""
+            INSERT INTO "{schema}".url_partitioned ({columns})
+            SELECT {columns} FROM "{schema}".url
+            WHERE id > $1 AND id <= $2
+            FOR KEY SHARE
+            ON CONFLICT DO NOTHING
+            """,
+            progress["last_id"],
+            last_id,
+        )
+        await connection.execute(
+            f"""
+            INSERT INTO "{schema}".url_hash (original_url_hash, code)
+            SELECT original_url_hash, code FROM "{schema}".url
+            WHERE id > $1 AND id <= $2 AND original_url_hash IS NOT NULL
+            ON CONFLICT DO NOTHING
+            """,
+            progress["last_id"],
+            last_id,
+        )
+        completed = last_id >= progress["max_id"]
+        await connection.execute(
+            f"""
+            UPDATE "{schema}".url_partition_backfill
+            SET last_id = $1, completed_at = CASE WHEN $2 THEN now() AT TIME ZONE 'UTC' END
+            WHERE id = 1
+            """,
+            last_id,
+            completed,
+        )
+
+    return int(status.split()[-1]), last_id, progress["max_id"], completed
+
+
+async def partition_urls(batch_size: int, sleep_seconds: float) -> None:
+    connection = await asyncpg.connect(
+        host=settings.db_host,
+        port=settings.db_port,
+        user=settings.db_user,
+        password=settings.db_pass,
+        database=settings.db_base,
+    )
+
+    try:
+        start = time.perf_counter()
+        copied = 0
+
+        while True:
+            batch_start = time.perf_counter()
+            batch_copied, last_id, max_id, completed = await copy_batch(connection, settings.db_schema, batch_size)
+            copied += batch_copied
+            rate = copied / (time.perf_counter() - start)
+            print(
+                f"last_id={last_id} max_id={max_id} copied={copied} "
+                f"batch={time.perf_counter() - batch_start:.2f}s rate={rate:,.0f} rows/sec"
+            )
+
+            if completed:
+                break
+
+            await asyncio.sleep(sleep_seconds)
+    finally:
+        await connection.close()
+
+    print("Copy of the url table finished, upgrade the database to swap the tables")
+
+
+def main() -> None:
+    """Entrypoint of the url table partitioning copy."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=10_000, help="ids per transaction")
+    parser.add_argument("--sleep", type=float, default=0.0, help="seconds to wait between batches")
+    args = parser.parse_args()
+
+    asyncio.run(partition_urls(args.batch_size, args.sleep))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Microbenchmark of the CPU time spent per code lookup.
+
+Compares the ORM path the redirect and preview pages used before, loading a
+`Url` instance with `get_by_code` and validating it into a schema, with the
+column-only `get_redirect_by_code` and `get_preview_by_code`. CPU time of this
+process is measured with `time.process_time`, so the time Postgres spends
+running the query is left out and only the client side cost is compared.
+
+Needs the database of the settings with at least one URL, run from the backend directory:
+    PYTHONPATH=. python scripts/benchmarks/code_lookup_cpu.py -n 5000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from app import repositories as repo
+from app import schemas
+from app.core.db import engine, session_factory
+from app.models import Url
+
+
+async def _cpu_per_lookup(name: str, lookup, lookups: int) -> None:
+    # Warm up the statement caches before measuring
+    for _ in range(100):
+        await lookup()
+
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+
+    for _ in range(lookups):
+        await lookup()
+
+    cpu_us = (time.process_time() - start_cpu) / lookups * 1_000_000
+    wall_us = (time.perf_counter() - start_wall) / lookups * 1_000_000
+    print(f"{name:<38} {cpu_us:>8.1f} us cpu/lookup  {wall_us:>8.1f} us wall/lookup")
+
+
+async def main(lookups: int) -> None:
+    async with session_factory() as session:
+        url_code = await session.scalar(select(Url.code).limit(1))
+
+        if url_code is None:
+            raise SystemExit("The url table is empty, create a URL first")
+
+        urls = repo.UrlShortener(session)
+
+        # The identity map is emptied after every ORM lookup, like a new request's session
+        async def orm_redirect() -> schemas.UrlCached:
+            url_cached = schemas.UrlCached.model_validate(await urls.get_by_code(url_code))
+            session.expunge_all()
+            return url_cached
+
+        async def orm_preview() -> schemas.UrlInDBBase:
+            url_in_db = schemas.UrlInDBBase.model_validate(await urls.get_by_code(url_code))
+            session.expunge_all()
+            return url_in_db
+
+        async def core_redirect() -> schemas.UrlCached | None:
+            return await urls.get_redirect_by_code(url_code)
+
+        async def core_preview() -> repo.UrlPreview | None:
+            return await urls.get_preview_by_code(url_code)
+
+        await _cpu_per_lookup("redirect, ORM + model_validate", orm_redirect, lookups)
+        await _cpu_per_lookup("redirect, get_redirect_by_code", core_redirect, lookups)
+        await _cpu_per_lookup("preview, ORM + model_validate", orm_preview, lookups)
+        await _cpu_per_lookup("preview, get_preview_by_code", core_preview, lookups)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--lookups", type=int, default=5_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.lookups))
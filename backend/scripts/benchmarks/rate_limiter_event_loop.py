@@ -0,0 +1,78 @@
+"""
+Load test of the rate limiter's effect on the event loop.
+
+Runs concurrent rate limit hits against Redis, once through the synchronous
+`limits` moving window limiter the middleware used before and once through
+the async `hit` of the middleware, while a monitor task measures how late the
+event loop wakes it up. A blocking limiter stalls the loop for a full Redis
+round-trip per hit, so the loop lag grows with the load and the hits run one at
+a time; the async limiter keeps the lag near zero and overlaps the round-trips.
+
+Needs a running Redis at REDIS_URL, run from the backend directory:
+    PYTHONPATH=. python scripts/benchmarks/rate_limiter_event_loop.py -n 20000 -c 100
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from limits import storage, strategies
+
+from app.core.config import settings
+from app.core.middleware.rate_limiter import hit, rate_limit_item_for
+
+MONITOR_INTERVAL_SECONDS = 0.005
+
+
+async def _monitor_loop_lag(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(MONITOR_INTERVAL_SECONDS)
+        lags.append(time.perf_counter() - start - MONITOR_INTERVAL_SECONDS)
+
+
+async def _run(name: str, hit_once, hits: int, concurrency: int) -> None:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_loop_lag(lags, stop))
+
+    async def worker(worker_id: int) -> None:
+        for index in range(hits // concurrency):
+            await hit_once(f"benchmark-{uuid.uuid4().hex[:8]}-{worker_id}-{index % 10}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    print(
+        f"{name:<22} {hits / elapsed:>10,.0f} hits/sec  "
+        f"loop lag p50={statistics.median(lags_ms):.2f}ms "
+        f"p99={lags_ms[int(len(lags_ms) * 0.99)]:.2f}ms max={lags_ms[-1]:.2f}ms"
+    )
+
+
+async def main(hits: int, concurrency: int, rate_per_minute: int) -> None:
+    sync_throttler = strategies.MovingWindowRateLimiter(storage.RedisStorage(str(settings.redis_url)))
+    item = rate_limit_item_for(rate_per_minute=rate_per_minute)
+
+    async def sync_hit(key: str) -> None:
+        sync_throttler.hit(item, key)
+
+    async def async_hit(key: str) -> None:
+        await hit(key=key, rate_per_minute=rate_per_minute)
+
+    await _run("sync (limits)", sync_hit, hits, concurrency)
+    await _run("async (redis.asyncio)", async_hit, hits, concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--hits", type=int, default=20_000)
+    parser.add_argument("-c", "--concurrency", type=int, default=100)
+    parser.add_argument("-r", "--rate-per-minute", type=int, default=1_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.hits, args.concurrency, args.rate_per_minute))
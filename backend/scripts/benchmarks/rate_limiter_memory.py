@@ -0,0 +1,84 @@
+"""
+Benchmark of the Redis memory used by the rate limiter strategies.
+
+Simulates a number of active clients that each sent some requests in the
+current minute, once with the moving window and once with the sliding window
+counter, and reports the growth of Redis `used_memory` and the memory of one
+key. The moving window stores one list entry per request, up to the limit,
+while the sliding window counter stores one small hash per client.
+
+Needs a running Redis at REDIS_URL, the keys are deleted after each run.
+Run from the backend directory:
+    PYTHONPATH=. python scripts/benchmarks/rate_limiter_memory.py --clients 100000 --requests 60
+"""
+import argparse
+import asyncio
+import time
+
+from app.core.config import RateLimitStrategy
+from app.core.middleware.rate_limiter import key_ttl_for, rate_limit_item_for, rate_limit_scripts
+from app.core.redis import redis_client
+
+PIPELINE_SIZE = 1_000
+
+
+def _redis_key(client_id: int, rate_per_minute: int, strategy: RateLimitStrategy) -> str:
+    key = rate_limit_item_for(rate_per_minute=rate_per_minute).key_for(f"benchmark-{client_id}/")
+    return key if strategy == RateLimitStrategy.moving_window else f"{key}/{strategy}"
+
+
+async def _used_memory() -> int:
+    return (await redis_client.info("memory"))["used_memory"]
+
+
+async def _run(strategy: RateLimitStrategy, clients: int, requests: int, rate_per_minute: int) -> None:
+    script = rate_limit_scripts[strategy]
+    item = rate_limit_item_for(rate_per_minute=rate_per_minute)
+    memory_before = await _used_memory()
+    start = time.perf_counter()
+
+    for first_client in range(0, clients, PIPELINE_SIZE):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for client_id in range(first_client, min(first_client + PIPELINE_SIZE, clients)):
+                for _ in range(requests):
+                    await script(
+                        keys=[_redis_key(client_id, rate_per_minute, strategy)],
+                        args=[time.time(), item.amount, item.get_expiry(), 1, key_ttl_for(item, strategy)],
+                        client=pipe,
+                    )
+
+            await pipe.execute()
+
+    elapsed = time.perf_counter() - start
+    memory_used = await _used_memory() - memory_before
+    key_memory = await redis_client.memory_usage(_redis_key(0, rate_per_minute, strategy))
+    print(
+        f"{strategy:<24} {memory_used / 1024 / 1024:>8.1f} MiB total  "
+        f"{memory_used / clients:>7.0f} bytes/client  {key_memory} bytes/key  "
+        f"{clients * requests / elapsed:>10,.0f} hits/sec"
+    )
+
+    for first_client in range(0, clients, PIPELINE_SIZE):
+        await redis_client.delete(
+            *(
+                _redis_key(client_id, rate_per_minute, strategy)
+                for client_id in range(first_client, min(first_client + PIPELINE_SIZE, clients))
+            )
+        )
+
+
+async def main(clients: int, requests: int, rate_per_minute: int) -> None:
+    try:
+        for strategy in rate_limit_scripts:
+            await _run(strategy, clients, requests, rate_per_minute)
+    finally:
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=60, help="requests per client in the minute")
+    parser.add_argument("--rate-per-minute", type=int, default=60)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.requests, args.rate_per_minute))
@@ -0,0 +1,62 @@
+"""
+Benchmark of redirect throughput against a running server.
+
+Sends GET requests for one short code with a fixed concurrency and reports
+requests per second and the status codes received. Run the server with a
+single worker to measure per worker throughput, once with the fast redirect
+path disabled and once enabled, and compare. Rate limiting is disabled for
+both runs, otherwise the run without the fast path mostly measures rejected
+requests, and the benchmark fails unless every response is a redirect:
+
+    GUNICORN_WORKERS_COUNT=1 RATE_LIMIT_ENABLED=false FAST_REDIRECT_ENABLED=false python main.py
+    GUNICORN_WORKERS_COUNT=1 RATE_LIMIT_ENABLED=false FAST_REDIRECT_ENABLED=true python main.py
+
+Then from the backend directory:
+    python scripts/benchmarks/redirect_throughput.py http://127.0.0.1:8000/<code>
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+
+REDIRECT_STATUSES = {302, 307}
+
+
+async def _worker(client: httpx.AsyncClient, url: str, requests: int, statuses: Counter) -> None:
+    for _ in range(requests):
+        response = await client.get(url)
+        statuses[response.status_code] += 1
+
+
+async def main(url: str, requests: int, concurrency: int) -> None:
+    statuses = Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(follow_redirects=False, limits=limits) as client:
+        # Warm up the server side caches before measuring
+        response = await client.get(url)
+
+        if response.status_code not in REDIRECT_STATUSES:
+            raise SystemExit(f"{url} answered {response.status_code} instead of a redirect")
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(_worker(client, url, requests // concurrency, statuses) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+    print(f"{sum(statuses.values()) / elapsed:,.0f} requests/sec, statuses: {dict(statuses)}")
+
+    if set(statuses) - REDIRECT_STATUSES:
+        raise SystemExit("Not every response was a redirect, is rate limiting disabled with RATE_LIMIT_ENABLED=false?")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url", help="URL of a short code on the running server")
+    parser.add_argument("-n", "--requests", type=int, default=20_000)
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.requests, args.concurrency))
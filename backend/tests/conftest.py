@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+# Settings are read at import time, the tests never connect to these servers
+for name, value in {
+    "BACKEND_HOST": "127.0.0.1",
+    "BACKEND_PORT": "8000",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_USER": "url-shortener",
+    "POSTGRES_PASSWORD": "url-shortener",
+    "POSTGRES_DB": "url-shortener",
+    "POSTGRES_DB_SCHEMA": "url-shortener",
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
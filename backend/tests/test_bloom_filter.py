@@ -0,0 +1,68 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.core.bloom_filter import CodeFilter
+
+
+class StreamedCodes:
+    def __init__(self, url_codes: list[str], streamed: asyncio.Event, resume: asyncio.Event) -> None:
+        self.url_codes = url_codes
+        self.streamed = streamed
+        self.resume = resume
+
+    async def partitions(self, size: int):
+        yield self.url_codes
+        # Lets the test invalidate codes while the build runs
+        self.streamed.set()
+        await self.resume.wait()
+
+
+def session_factory_for(url_codes: list[str], streamed: asyncio.Event, resume: asyncio.Event):
+    class Session:
+        async def stream_scalars(self, statement) -> StreamedCodes:
+            return StreamedCodes(url_codes, streamed, resume)
+
+    @asynccontextmanager
+    async def session_factory():
+        yield Session()
+
+    return session_factory
+
+
+def make_filter() -> CodeFilter:
+    return CodeFilter(capacity=1000, false_positive_rate=0.001, rebuild_interval_seconds=3600, enabled=True)
+
+
+async def build_while(code_filter: CodeFilter, url_codes: list[str], during_build) -> None:
+    streamed, resume = asyncio.Event(), asyncio.Event()
+    build = asyncio.create_task(code_filter.build(session_factory_for(url_codes, streamed, resume)))
+    await streamed.wait()
+    during_build()
+    resume.set()
+    await build
+
+
+@pytest.mark.anyio
+async def test_build_keeps_codes_created_while_building() -> None:
+    code_filter = make_filter()
+
+    await build_while(code_filter, ["abc"], lambda: code_filter.invalidated(["new"]))
+
+    assert code_filter.ready
+    assert code_filter.might_exist("abc")
+    assert code_filter.might_exist("new")
+    assert not code_filter.might_exist("missing")
+
+
+@pytest.mark.anyio
+async def test_resubscribe_drops_the_filter_and_discards_the_running_build() -> None:
+    code_filter = make_filter()
+    await build_while(code_filter, ["abc"], lambda: None)
+
+    # Codes created while the subscription was lost never reached this worker
+    await build_while(code_filter, ["abc"], code_filter.resubscribed)
+
+    assert not code_filter.ready
+    assert code_filter.might_exist("created-while-disconnected")
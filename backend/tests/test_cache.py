@@ -0,0 +1,235 @@
+import asyncio
+import json
+
+import pytest
+from redis.exceptions import RedisError
+
+from app import schemas
+from app.core import cache
+from app.core.cache import LocalCache, UrlCache
+from app.core.circuit_breaker import CircuitBreaker
+
+
+def make_url(code: str) -> schemas.UrlCached:
+    return schemas.UrlCached(id=1, code=code, original_url=f"https://example.com/{code}")
+
+
+def make_cache(ttl_seconds: int = 60) -> UrlCache:
+    # Only the worker local state is used, the Redis client is never reached
+    return UrlCache(None, LocalCache(enabled=False), ttl_seconds=ttl_seconds, enabled=False)
+
+
+@pytest.mark.anyio
+async def test_warm_up_skips_codes_invalidated_while_streaming() -> None:
+    url_cache = make_cache()
+    url_cache.start_warm_up()
+    # Invalidated after the warm up query read its rows, before they were preloaded
+    url_cache._invalidated(["abc"])
+
+    assert url_cache.warm_up(make_url("abc")) is False
+    assert url_cache.warm_up(make_url("def")) is True
+
+    url_cache.finish_warm_up()
+
+    assert await url_cache.get("abc") == (False, None)
+    assert await url_cache.get("def") == (True, make_url("def"))
+
+
+@pytest.mark.anyio
+async def test_warm_up_stops_preloading_after_resubscribe() -> None:
+    url_cache = make_cache()
+    url_cache.start_warm_up()
+    url_cache.warm_up(make_url("abc"))
+    url_cache._resubscribed()
+
+    assert url_cache.warm_up(make_url("def")) is False
+    assert url_cache.warm == {}
+
+
+@pytest.mark.anyio
+async def test_warm_entries_expire() -> None:
+    url_cache = make_cache(ttl_seconds=0)
+    url_cache.start_warm_up()
+    url_cache.warm_up(make_url("abc"))
+    url_cache.finish_warm_up()
+
+    assert await url_cache.get("abc") == (False, None)
+    assert url_cache.warm == {}
+
+
+class FailingPipelineRedis:
+    """Redis client whose pipelines fail until `failures` runs out."""
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.published = []
+
+    def pipeline(self, transaction: bool = True) -> "FailingPipelineRedis":
+        self._commands = []
+        return self
+
+    async def __aenter__(self) -> "FailingPipelineRedis":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+    def publish(self, channel: str, message: str) -> None:
+        self._commands.append(message)
+
+    async def execute(self) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise RedisError("Connection refused")
+
+        self.published.extend(self._commands)
+
+
+@pytest.mark.anyio
+async def test_failed_invalidations_are_republished(monkeypatch) -> None:
+    async def sleep(seconds: float) -> None:
+        return None
+
+    monkeypatch.setattr(cache.asyncio, "sleep", sleep)
+    client = FailingPipelineRedis(failures=3)
+    url_cache = UrlCache(client, LocalCache(enabled=False), enabled=False)
+
+    await url_cache.invalidate("abc")
+    await url_cache.invalidate("def")
+    await url_cache._republish_task
+
+    assert len(client.published) == 1
+    assert sorted(json.loads(client.published[0])) == ["abc", "def"]
+    assert url_cache._unpublished == set()
+
+
+class UnreachableRedis:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def get(self, key: str) -> str:
+        self.calls += 1
+        raise RedisError("Timeout reading from socket")
+
+    async def ping(self) -> bool:
+        raise RedisError("Timeout reading from socket")
+
+
+@pytest.mark.anyio
+async def test_cache_skips_redis_while_the_breaker_is_open(caplog) -> None:
+    client = UnreachableRedis()
+    breaker = CircuitBreaker(
+        name="redis",
+        probe=client.ping,
+        failure_threshold=2,
+        cooldown_seconds=0,
+        probe_timeout_seconds=1,
+    )
+    url_cache = UrlCache(client, LocalCache(enabled=False), breaker=breaker)
+
+    try:
+        results = [await url_cache.get("abc") for _ in range(5)]
+        # Lets the probe run
+        while not breaker.transitions["half-open->open"]:
+            await asyncio.sleep(0)
+    finally:
+        breaker._probe_task.cancel()
+
+    assert results == [(False, None)] * 5
+    assert client.calls == 2
+    assert breaker.fallback_hits == 3
+    assert "Circuit breaker redis open->half-open" in caplog.text
+    assert "Circuit breaker redis half-open->open after a failed probe" in caplog.text
+
+
+class KeyValueRedis:
+    """Redis client holding plain string keys, enough for GET, SET NX, EXISTS, DEL and the lock release script."""
+
+    def __init__(self) -> None:
+        self.values = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.values.get(key)
+
+    async def set(self, key: str, value: object, nx: bool = False, **expiry) -> bool:
+        if nx and key in self.values:
+            return False
+
+        self.values[key] = str(value)
+
+        return True
+
+    async def exists(self, key: str) -> int:
+        return int(key in self.values)
+
+    async def delete(self, key: str) -> int:
+        return int(self.values.pop(key, None) is not None)
+
+    async def eval(self, script: str, numkeys: int, key: str, token: str) -> int:
+        assert script == cache.RELEASE_LOCK_SCRIPT
+
+        if self.values.get(key) != token:
+            return 0
+
+        return await self.delete(key)
+
+
+@pytest.mark.anyio
+async def test_warm_up_codes_are_loaded_once_and_shared() -> None:
+    client = KeyValueRedis()
+    loads = []
+    release_load = asyncio.Event()
+
+    async def load() -> list[str]:
+        loads.append("load")
+        await release_load.wait()
+        return ["abc", "def"]
+
+    caches = [UrlCache(client, LocalCache(enabled=False)) for _ in range(3)]
+    tasks = [asyncio.create_task(url_cache.shared_warm_up_codes(load)) for url_cache in caches]
+    # Lets every worker reach the lock before the first one finishes loading
+    await asyncio.sleep(0.01)
+    release_load.set()
+
+    assert await asyncio.gather(*tasks) == [["abc", "def"]] * 3
+    assert loads == ["load"]
+    assert not await client.exists(f"{cache.settings.cache_key_prefix}:warm-up-codes:lock")
+
+
+@pytest.mark.anyio
+async def test_warm_up_codes_are_loaded_locally_when_the_loading_worker_fails() -> None:
+    client = KeyValueRedis()
+
+    async def failing_load() -> list[str]:
+        raise OSError("connection refused")
+
+    async def load() -> list[str]:
+        return ["abc"]
+
+    with pytest.raises(OSError):
+        await UrlCache(client, LocalCache(enabled=False)).shared_warm_up_codes(failing_load)
+
+    assert await UrlCache(client, LocalCache(enabled=False)).shared_warm_up_codes(load) == ["abc"]
+
+
+@pytest.mark.anyio
+async def test_expired_fill_lock_is_not_released_by_its_previous_holder() -> None:
+    client = KeyValueRedis()
+    url_cache = UrlCache(client, LocalCache(enabled=False))
+    lock_key = f"{url_cache.key_for('abc')}:lock"
+
+    acquired, slow_token = await url_cache.acquire_fill_lock("abc")
+    assert acquired
+    assert await url_cache.acquire_fill_lock("abc") == (False, None)
+
+    # The slow holder's lock expires and another worker takes it
+    await client.delete(lock_key)
+    acquired, token = await url_cache.acquire_fill_lock("abc")
+    assert acquired
+    assert token != slow_token
+
+    await url_cache.release_fill_lock("abc", slow_token)
+    assert await client.get(lock_key) == token
+
+    await url_cache.release_fill_lock("abc", token)
+    assert await client.get(lock_key) is None
@@ -0,0 +1,72 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+
+from app import repositories as repo
+from app.core.click_buffer import ClickBuffer
+
+ACCESS_DATE = datetime(2026, 10, 18)
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, statement) -> None:
+        self.statements.append(statement)
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+
+@asynccontextmanager
+async def failing_session_factory():
+    raise OperationalError("UPDATE url", {}, OSError("connection refused"))
+    yield
+
+
+@pytest.mark.anyio
+async def test_bulk_increment_access_count_stays_below_the_bind_parameter_limit() -> None:
+    session = RecordingSession()
+    url_accesses = {f"code{index:05}": (1, ACCESS_DATE) for index in range(12_000)}
+
+    await repo.UrlShortener(session).bulk_increment_access_count(url_accesses)
+
+    parameter_counts = [
+        len(statement.compile(dialect=postgresql.asyncpg.dialect()).params) for statement in session.statements
+    ]
+    assert parameter_counts == [15_000, 15_000, 6_000]
+    assert session.commits == 1
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_clicks_within_the_retained_limit() -> None:
+    click_buffer = ClickBuffer(flush_interval_seconds=5, max_pending=2, max_retained=3, max_retry_delay_seconds=60)
+
+    for url_code in ("a", "b", "c"):
+        click_buffer.record(url_code, last_access_date=ACCESS_DATE)
+
+    assert await click_buffer.flush(failing_session_factory) == 0
+
+    click_buffer.record("a", clicks=2, last_access_date=ACCESS_DATE)
+    click_buffer.record("d", clicks=4, last_access_date=ACCESS_DATE)
+
+    assert click_buffer._pending == {"a": (3, ACCESS_DATE), "b": (1, ACCESS_DATE), "c": (1, ACCESS_DATE)}
+    assert click_buffer.dropped_clicks == 4
+
+
+@pytest.mark.anyio
+async def test_failed_flushes_back_off_exponentially() -> None:
+    click_buffer = ClickBuffer(flush_interval_seconds=5, max_pending=10, max_retained=10, max_retry_delay_seconds=30)
+    click_buffer.record("a", last_access_date=ACCESS_DATE)
+    delays = [click_buffer.retry_delay_seconds()]
+
+    for _ in range(4):
+        await click_buffer.flush(failing_session_factory)
+        delays.append(click_buffer.retry_delay_seconds())
+
+    assert delays == [0, 5, 10, 20, 30]
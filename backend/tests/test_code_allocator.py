@@ -0,0 +1,60 @@
+import pytest
+
+from app.core.cache import UrlCache
+from app.core.code_allocator import RedisIdBlocks, get_code_allocator
+from app.core.config import CodeAllocatorKind, CodeIdSource, settings
+
+
+class FakeRedis:
+    def __init__(self, values: dict[str, str] | None = None) -> None:
+        self.values = dict(values or {})
+
+    async def get(self, key: str) -> str | None:
+        return self.values.get(key)
+
+    async def set(self, key: str, value, nx: bool = False) -> bool:
+        if nx and key in self.values:
+            return False
+
+        self.values[key] = str(value)
+        return True
+
+    async def incrby(self, key: str, amount: int) -> int:
+        self.values[key] = str(int(self.values.get(key, 0)) + amount)
+        return int(self.values[key])
+
+
+def test_redis_id_counter_is_outside_the_cache_namespace(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "code_allocator", CodeAllocatorKind.counter)
+    monkeypatch.setattr(settings, "code_id_source", CodeIdSource.redis)
+    monkeypatch.setattr(settings, "code_obfuscation_key", "secret")
+
+    counter_key = get_code_allocator().ids.blocks.key
+
+    # A URL with any code, "counter" included, must not map to the counter
+    assert not counter_key.startswith(UrlCache.key_for(""))
+
+
+@pytest.mark.anyio
+async def test_redis_id_blocks_continue_after_the_legacy_counter() -> None:
+    client = FakeRedis({"legacy": "20"})
+    blocks = RedisIdBlocks(client, "counter", legacy_key="legacy")
+
+    assert list(await blocks.lease(3)) == [21, 22, 23]
+    assert list(await blocks.lease(2)) == [24, 25]
+
+
+@pytest.mark.anyio
+async def test_redis_id_blocks_keep_an_existing_counter() -> None:
+    client = FakeRedis({"legacy": "20", "counter": "50"})
+    blocks = RedisIdBlocks(client, "counter", legacy_key="legacy")
+
+    assert list(await blocks.lease(2)) == [51, 52]
+
+
+@pytest.mark.anyio
+async def test_redis_id_blocks_skip_a_legacy_counter_overwritten_by_the_cache() -> None:
+    client = FakeRedis({"legacy": '{"id": 1, "code": "counter"}'})
+    blocks = RedisIdBlocks(client, "counter", legacy_key="legacy")
+
+    assert list(await blocks.lease(2)) == [1, 2]
@@ -0,0 +1,122 @@
+import itertools
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import deps, repositories as repo, schemas
+from app.core.db import engine
+from app.models import Url
+
+
+def make_url(url_id: int, code: str, original_url: str) -> Url:
+    return Url(
+        id=url_id,
+        code=code,
+        original_url=original_url,
+        original_url_hash=deps.hash_url(original_url),
+        access_count=0,
+    )
+
+
+def fake_bulk_create_or_get(taken_codes: set[str], calls: list[list[str]]):
+    """Inserts URLs whose code is free, like the repository method against the database."""
+
+    async def bulk_create_or_get(self, urls_in: list[schemas.UrlCreate]) -> tuple[list[Url], list[schemas.UrlCreate]]:
+        calls.append([url_in.code for url_in in urls_in])
+        urls_new = [url_in for url_in in urls_in if url_in.code not in taken_codes]
+        taken_codes.update(url_in.code for url_in in urls_new)
+
+        return (
+            [make_url(2, url_in.code, url_in.original_url) for url_in in urls_new],
+            [url_in for url_in in urls_in if url_in not in urls_new],
+        )
+
+    return bulk_create_or_get
+
+
+@pytest.mark.anyio
+async def test_bulk_create_short_urls_retries_only_colliding_codes(monkeypatch) -> None:
+    urls = [f"https://example.com/{index}" for index in range(5)]
+    # The third URL of the batch collides with a code that already exists
+    allocated_codes = iter(["code0", "code1", "taken", "code3", "code4", "code5"])
+    bulk_create_calls = []
+
+    async def allocate() -> str:
+        return next(allocated_codes)
+
+    async def get_many_by_url_hash(self, url_hashes: list[bytes]) -> list[Url]:
+        return []
+
+    monkeypatch.setattr(deps.code_allocator, "allocate", allocate)
+    monkeypatch.setattr(repo.UrlShortener, "get_many_by_url_hash", get_many_by_url_hash)
+    monkeypatch.setattr(repo.UrlShortener, "bulk_create_or_get", fake_bulk_create_or_get({"taken"}, bulk_create_calls))
+
+    async with AsyncSession(engine) as db:
+        result = await deps.bulk_create_short_urls(schemas.UrlBulkCreate(urls=urls), db)
+
+    assert bulk_create_calls == [["code0", "code1", "taken", "code3", "code4"], ["code5"]]
+    assert [(item.code, item.error) for item in result.urls] == [
+        ("code0", None), ("code1", None), ("code5", None), ("code3", None), ("code4", None),
+    ]
+
+
+@pytest.mark.anyio
+async def test_bulk_create_short_urls_keeps_existing_urls_when_retrying(monkeypatch) -> None:
+    existing_url = "https://example.com/existing"
+    new_url = "https://example.com/new"
+    codes = itertools.count()
+    bulk_create_calls = []
+
+    async def allocate() -> str:
+        return f"code{next(codes)}"
+
+    async def get_many_by_url_hash(self, url_hashes: list[bytes]) -> list[Url]:
+        # Loaded into the session, so the commit of every attempt expires it
+        url_db = make_url(1, "exists", existing_url)
+        make_transient_to_detached(url_db)
+        return [await self.session.merge(url_db, load=False)]
+
+    monkeypatch.setattr(deps.code_allocator, "allocate", allocate)
+    monkeypatch.setattr(repo.UrlShortener, "get_many_by_url_hash", get_many_by_url_hash)
+    monkeypatch.setattr(repo.UrlShortener, "bulk_create_or_get", fake_bulk_create_or_get({"code0"}, bulk_create_calls))
+
+    async with AsyncSession(engine) as db:
+        result = await deps.bulk_create_short_urls(schemas.UrlBulkCreate(urls=[existing_url, new_url]), db)
+
+    assert bulk_create_calls == [["code0"], ["code1"]]
+    assert [(item.code, item.error) for item in result.urls] == [("exists", None), ("code1", None)]
+
+
+@pytest.mark.anyio
+async def test_load_url_code_releases_fill_lock_when_query_fails(monkeypatch) -> None:
+    sessions = []
+    released_codes = []
+
+    @asynccontextmanager
+    async def session_factory():
+        sessions.append("session")
+        yield "session"
+
+    async def acquire_fill_lock(url_code: str) -> tuple[bool, str]:
+        return True, "token"
+
+    async def release_fill_lock(url_code: str, token: str) -> None:
+        released_codes.append((url_code, token))
+
+    async def get_redirect_by_code(self, url_code: str) -> None:
+        raise OperationalError("SELECT url", {}, OSError("connection refused"))
+
+    monkeypatch.setattr(deps.settings, "single_flight_lock_enabled", True)
+    monkeypatch.setattr(deps, "session_factory", session_factory)
+    monkeypatch.setattr(deps.url_cache, "acquire_fill_lock", acquire_fill_lock)
+    monkeypatch.setattr(deps.url_cache, "release_fill_lock", release_fill_lock)
+    monkeypatch.setattr(repo.UrlShortener, "get_redirect_by_code", get_redirect_by_code)
+
+    with pytest.raises(OperationalError):
+        await deps.load_url_code("abc")
+
+    assert sessions == ["session"]
+    assert released_codes == [("abc", "token")]
@@ -0,0 +1,43 @@
+import pytest
+
+import import_urls
+
+
+def test_read_records_rejects_malformed_lines_and_keeps_reading(tmp_path) -> None:
+    input_path = tmp_path / "links.ndjson"
+    input_path.write_bytes(
+        b'{"url": "https://example.com/a"}\n'
+        b'\xff\xfe\n'
+        b'{"url": \n'
+        b'["https://example.com/b"]\n'
+        b'{"url": "https://example.com/c"}\n'
+    )
+
+    chunks = list(import_urls.read_records(input_path, "ndjson", 0, chunk_size=10))
+
+    assert len(chunks) == 1
+    records, malformed, offset = chunks[0]
+    assert records == [{"url": "https://example.com/a"}, {"url": "https://example.com/c"}]
+    assert [reject["offset"] for reject in malformed] == [33, 36, 45]
+    assert [reject["reason"].split(":")[0] for reject in malformed] == ["malformed line"] * 3
+    assert offset == input_path.stat().st_size
+
+
+@pytest.mark.anyio
+async def test_prepare_rows_returns_rejects_for_invalid_records(monkeypatch) -> None:
+    async def allocate() -> str:
+        return "allocated"
+
+    monkeypatch.setattr(import_urls.code_allocator, "allocate", allocate)
+
+    rows, own_codes, invalid = await import_urls.prepare_rows([
+        {"url": "https://example.com/a"},
+        {"url": "not a url"},
+        {"url": 5},
+        {"url": "https://example.com/b", "code": "not-alphanumeric"},
+        {"url": "https://example.com/c", "code": "own"},
+    ])
+
+    assert [row[import_urls.IMPORT_COLUMNS.index("code")] for row in rows] == ["allocated", "own"]
+    assert own_codes == [False, True]
+    assert [reject["reason"] for reject in invalid] == ["invalid URL", "invalid URL", "invalid code"]
@@ -0,0 +1,133 @@
+import json
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import repositories as repo
+from app.core.db import ReplicaRouter
+
+
+class FakeReplica:
+    """Replica whose sessions are plain names, reads see which one they got."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.ejected_until = 0.0
+
+    @asynccontextmanager
+    async def session_factory(self):
+        yield self.name
+
+
+def make_router(*names: str) -> ReplicaRouter:
+    router = ReplicaRouter(urls=[], ejection_seconds=30, read_your_writes_seconds=5)
+    router.replicas = [FakeReplica(name) for name in names]
+    return router
+
+
+def test_replica_for_round_robins_over_replicas() -> None:
+    router = make_router("replica-1", "replica-2")
+
+    assert [router.replica_for("abc").name for _ in range(4)] == ["replica-1", "replica-2"] * 2
+
+
+def test_replica_for_skips_ejected_replicas() -> None:
+    router = make_router("replica-1", "replica-2")
+    router.eject(router.replicas[0], OSError("connection refused"))
+
+    assert [router.replica_for("abc").name for _ in range(2)] == ["replica-2", "replica-2"]
+
+    router.eject(router.replicas[1], OSError("connection refused"))
+
+    assert router.replica_for("abc") is None
+
+
+def test_replica_for_reads_written_codes_on_primary() -> None:
+    router = make_router("replica-1")
+    router.invalidated(["abc"])
+
+    assert router.replica_for("abc") is None
+    assert router.replica_for("def").name == "replica-1"
+
+
+def test_replica_for_reads_everything_on_primary_after_resubscribe() -> None:
+    router = make_router("replica-1")
+    router.resubscribed()
+
+    assert router.replica_for("abc") is None
+
+
+@pytest.mark.anyio
+async def test_read_uses_replica_result() -> None:
+    sessions = []
+
+    async def read(session) -> str:
+        sessions.append(session)
+        return "url"
+
+    result = await repo.UrlShortener("primary", replicas=make_router("replica-1"))._read(read, "abc")
+
+    assert result == "url"
+    assert sessions == ["replica-1"]
+
+
+@pytest.mark.anyio
+async def test_read_confirms_replica_miss_on_primary() -> None:
+    sessions = []
+
+    async def read(session) -> str | None:
+        # The code was created on the primary and did not reach the replica yet
+        sessions.append(session)
+        return "url" if session == "primary" else None
+
+    result = await repo.UrlShortener("primary", replicas=make_router("replica-1"))._read(read, "abc")
+
+    assert result == "url"
+    assert sessions == ["replica-1", "primary"]
+
+
+@pytest.mark.anyio
+async def test_read_ejects_failing_replica_and_falls_back_to_primary() -> None:
+    router = make_router("replica-1", "replica-2")
+    sessions = []
+
+    async def read(session) -> str:
+        sessions.append(session)
+
+        if session == "replica-1":
+            raise OperationalError("SELECT 1", {}, OSError("connection refused"))
+
+        return "url"
+
+    url_repo = repo.UrlShortener("primary", replicas=router)
+
+    assert await url_repo._read(read, "abc") == "url"
+    assert await url_repo._read(read, "abc") == "url"
+    assert await url_repo._read(read, "abc") == "url"
+    assert sessions == ["replica-1", "primary", "replica-2", "replica-2"]
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(
+    len(json.loads(os.getenv("TEST_DB_REPLICA_URLS", "[]"))) < 2,
+    reason='set TEST_DB_REPLICA_URLS to the DSNs of two replicas, e.g. ["postgresql+asyncpg://..."]',
+)
+async def test_reads_are_spread_over_real_replicas() -> None:
+    router = ReplicaRouter(urls=json.loads(os.environ["TEST_DB_REPLICA_URLS"]))
+    url_repo = repo.UrlShortener(None, replicas=router)
+
+    async def read(session) -> str:
+        return await session.scalar(
+            text("SELECT coalesce(inet_server_addr()::text, 'local') || ':' || inet_server_port()")
+        )
+
+    try:
+        servers = [await url_repo._read(read, f"code{index}") for index in range(4)]
+    finally:
+        await router.dispose()
+
+    assert servers[0] != servers[1]
+    assert servers[:2] == servers[2:]
@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app import repositories as repo
+from app.core.db import ReplicaRouter
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.statements = []
+
+    async def scalar(self, statement):
+        self.statements.append(statement)
+        return None
+
+
+def where_clause(statement) -> str:
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    return sql[sql.index("WHERE"):]
+
+
+@pytest.mark.anyio
+async def test_get_by_id_keeps_working_without_a_code() -> None:
+    session = RecordingSession()
+    url_repo = repo.UrlShortener(session, replicas=ReplicaRouter(urls=[]))
+
+    await url_repo.get(1)
+    await url_repo.get(1, "abc")
+
+    assert [where_clause(statement) for statement in session.statements] == [
+        'WHERE "url-shortener".url.id = %(id_1)s',
+        'WHERE "url-shortener".url.id = %(id_1)s AND "url-shortener".url.code = %(code_1)s',
+    ]